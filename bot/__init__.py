@@ -1 +1 @@
-from .bot import create_session, start_bot
+from .bot import create_session, create_sessions, deliver_planned, sessions_due, planned_due, start_bot
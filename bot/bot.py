@@ -1,23 +1,38 @@
 import datetime
-import json
 import os
-from threading import Thread
+from threading import Thread, Lock
 
 import telebot
-from sqlalchemy import select
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 
 from models import db_session
 from models.questions import Question, QuestionAnswer, AnswerState
+from models.stats import AnswerResult, answer_result, update_stat
 from models.users import Person, PersonGroup, PersonGroupAssociation
-from tools import Settings
+from tools import Settings, EventBus
 import random
-from .generators import Session
+from .generators import Session, StatRandomGenerator
+from .outbound import OutboundQueue
+from .reaper import SessionReaper
+from .render import QuestionCache
+from .state import create_store, RecentIds
+from .webhook import UpdateDispatcher, WebhookServer
+from .workers import ShardedWorkers
 
 bot = telebot.TeleBot(os.environ['TGTOKEN'])
-people = dict()
-target_levels = dict()
-sessions = dict()
+outbound = OutboundQueue(bot, workers=int(os.environ.get("TG_SEND_WORKERS", 4)))
+# the next question after an answer is sent from the worker of the chat, so the hand-offs of a chat are sequential
+session_workers = ShardedWorkers(lambda tg_id, state: send_question(tg_id),
+                                 int(os.environ.get("TG_SESSION_WORKERS", 4)), name="session")
+# the stored session of a chat is read and written under the chat's lock, so a question is taken from it once
+session_locks = [Lock() for _ in range(64)]
+question_cache = QuestionCache()
+EventBus().subscribe("question_changed", question_cache.invalidate)
+states = create_store()
+handled_answers = RecentIds()
+REGISTRATION_TTL = datetime.timedelta(days=1)
 stickers = {"right_answer": ["CAACAgIAAxkBAAKlemTKcX143oNSqGVlHIjpmf5aWzRBAAJKFwACerrwSw3OVyhI-ZjLLwQ",
                              "CAACAgIAAxkBAAKmFWTKqiMrZzmS3yHPHN3nAAHUbElf3gACgRMAAvop0En6hsvCGJL_oy8E",
                              "CAACAgIAAxkBAAKlfGTKcYgpLL0FuHVCcRa_3cQBqnfJAAI0EgACEoP5S_q_MUdvvcoCLwQ",
@@ -73,12 +88,15 @@ def submit_buttons(call: CallbackQuery):
 
 def target_level(message: Message):
     tg_id = message.chat.id
+    registration = states.get("registration", tg_id)
 
-    if list(people[tg_id].groups):
+    if registration and registration["group_ids"]:
         bot.send_message(tg_id, "Теперь нужно ввести уровень каждой выбранной вами группы(уровень - целое число)")
-        bot.send_message(tg_id, list(people[tg_id].groups)[0].name)
-        target_levels[tg_id] = []
+        bot.send_message(tg_id, group_name(registration["group_ids"][0]))
+        registration["target_levels"] = []
+        states.set("registration", tg_id, registration, registration_expiry())
     else:
+        states.delete("registration", tg_id)
         bot.send_message(tg_id, "Регистрация завершена. Теперь вам будут приходить вопросы в тестовой форме, "
                                 "на которые нужно будет отвечать. Желаю удачи")
 
@@ -87,28 +105,44 @@ def target_level(message: Message):
 def add_target_level(message: Message):
     if not message.text.isdigit():
         bot.send_message(message.chat.id, "Неверный формат ввода, нужно ввести число. Попробуйте ещё раз")
+        return
+
+    registration = states.get("registration", message.chat.id)
+    if registration is None or "target_levels" not in registration:
+        return
+
+    registration["target_levels"].append(int(message.text))
+    if len(registration["target_levels"]) < len(registration["group_ids"]):
+        states.set("registration", message.chat.id, registration, registration_expiry())
+        bot.send_message(message.chat.id, group_name(registration["group_ids"][len(registration["target_levels"])]))
     else:
-        with db_session.create_session():
-            target_levels[message.chat.id].append(int(message.text))
-            if len(target_levels[message.chat.id]) < len(people[message.chat.id].groups):
-                bot.send_message(message.chat.id, people[message.chat.id].groups[len(target_levels[message.chat.id])].
-                                 name)
-            else:
-                update_target_levels(message)
+        update_target_levels(message, registration)
 
 
-def update_target_levels(message: Message):
+def update_target_levels(message: Message, registration: dict):
     tg_id = message.chat.id
     with db_session.create_session() as db:
-        for group in range(len(target_levels[tg_id])):
-            level = db.scalar(select(PersonGroupAssociation).where(PersonGroupAssociation.person_id == people[tg_id].id)
-                              .where(PersonGroupAssociation.group_id == people[tg_id].groups[group].id))
-            level.target_level = target_levels[tg_id][group]
-            db.commit()
+        for group_id, level in zip(registration["group_ids"], registration["target_levels"]):
+            association = db.scalar(select(PersonGroupAssociation).
+                                    where(PersonGroupAssociation.person_id == registration["person_id"]).
+                                    where(PersonGroupAssociation.group_id == group_id))
+            association.target_level = level
+        db.commit()
+
+    states.delete("registration", tg_id)
     bot.send_message(tg_id, "Регистрация завершена. Теперь вам будут приходить вопросы в тестовой форме, "
                             "на которые нужно будет отвечать. Желаю удачи")
 
 
+def group_name(group_id: int) -> str:
+    with db_session.create_session() as db:
+        return db.scalar(select(PersonGroup.name).where(PersonGroup.id == group_id))
+
+
+def registration_expiry() -> datetime.datetime:
+    return datetime.datetime.now() + REGISTRATION_TTL
+
+
 def password_check(message: Message):
     if message.text == Settings()["tg_pin"]:
         person_in_db = False
@@ -136,8 +170,8 @@ def get_information_about_person(message: Message):
                          'Попробуйте ввести ещё раз.')
         bot.register_next_step_handler(message, get_information_about_person)
     else:
-        people[message.from_user.id] = Person()
-        people[message.from_user.id].full_name = full_name
+        states.set("registration", message.from_user.id, {"full_name": full_name, "group_ids": []},
+                   registration_expiry())
         profession_markup = InlineKeyboardMarkup()
 
         with db_session.create_session() as db:
@@ -151,30 +185,39 @@ def get_information_about_person(message: Message):
 
 def add_new_person(call: CallbackQuery):
     telegram_id = call.from_user.id
-    people[telegram_id].tg_id = telegram_id
+    registration = states.get("registration", telegram_id)
+    if registration is None:
+        return
+
     with db_session.create_session() as db:
-        db.add(people[telegram_id])
+        person = Person(full_name=registration["full_name"], tg_id=telegram_id)
+        person.groups.extend(db.scalars(select(PersonGroup).where(PersonGroup.id.in_(registration["group_ids"]))))
+        db.add(person)
         db.commit()
-        target_level(call.message)
+
+        registration["person_id"] = person.id
+        states.set("registration", telegram_id, registration, registration_expiry())
+    target_level(call.message)
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('group'))
 def select_groups(call: CallbackQuery):
-    with db_session.create_session() as db:
+    registration = states.get("registration", call.from_user.id)
+    if registration is None:
+        return
 
-        group_id = int(call.data.split('_')[1])
-        groups = db.scalars(select(PersonGroup))
-        person = people[call.from_user.id]
-        current_group = db.scalars(select(PersonGroup).where(PersonGroup.id == group_id)).first()
+    group_id = int(call.data.split('_')[1])
+    if group_id not in registration["group_ids"]:
+        registration["group_ids"].append(group_id)
+    else:
+        registration["group_ids"].remove(group_id)
+    states.set("registration", call.from_user.id, registration, registration_expiry())
 
-        if current_group.id not in [group.id for group in person.groups]:
-            person.groups.append(current_group)
-        else:
-            person.groups.remove([group for group in person.groups if group.id == group_id][0])
+    with db_session.create_session() as db:
         groups_markup = InlineKeyboardMarkup()
 
-        for prof in groups:
-            if prof.id in [i.id for i in person.groups]:
+        for prof in db.scalars(select(PersonGroup)):
+            if prof.id in registration["group_ids"]:
                 groups_markup.add(InlineKeyboardButton(prof.name + "\U00002713", callback_data='group_' + str(prof.id)))
             else:
                 groups_markup.add(InlineKeyboardButton(prof.name, callback_data='group_' + str(prof.id)))
@@ -186,80 +229,201 @@ def select_groups(call: CallbackQuery):
 # первыйй ответ дня, пять правильых ответов подряд ачивкки
 
 
-def create_session(person: Person):
-    session = Session(person, Settings()["max_time"], Settings()["max_questions"])
-    sessions[person.tg_id] = session
-    session.generate_questions()
-    send_question(person)
+def create_sessions(persons: list[Person]):
+    bunches = StatRandomGenerator().next_bunches(persons, Settings()["max_questions"])
+    for person in persons:
+        create_session(person, bunches[person.id])
+
+
+def deliver_planned(answers: list[QuestionAnswer]):
+    planned = {}
+    for answer in answers:
+        planned.setdefault(answer.person_id, (answer.person, []))[1].append(answer)
+
+    for person, person_answers in planned.values():
+        with session_lock(person.tg_id):
+            state = states.get("session", person.tg_id)
+            if state is not None:
+                # a running session asks them after its current question, if it ends first the next one picks them up
+                session = Session.from_dict(state)
+                session.add_planned(person_answers)
+                states.set("session", person.tg_id, session.to_dict(), session.end_time)
+                continue
+
+            store_session(person, person_answers)
+        send_question(person.tg_id)
+
+
+def sessions_due(person_ids: list[int], **_):
+    """Handler of the scheduler's "sessions_due" event when it runs in another process."""
+    with db_session.create_session() as db:
+        persons = db.scalars(select(Person).where(Person.id.in_(person_ids), Person.is_paused.is_(False))).all()
+    if persons:
+        create_sessions(persons)
+
+
+def planned_due(answer_ids: list[int], **_):
+    """Handler of the scheduler's "planned_due" event when it runs in another process."""
+    with db_session.create_session() as db:
+        answers = db.scalars(select(QuestionAnswer).
+                             options(joinedload(QuestionAnswer.person)).
+                             where(QuestionAnswer.id.in_(answer_ids),
+                                   QuestionAnswer.state == AnswerState.NOT_ANSWERED).
+                             order_by(QuestionAnswer.ask_time)).all()
+    if answers:
+        deliver_planned(answers)
+
+
+def close_expired(person_ids: list[int]):
+    """Frees the expired sessions of the persons whose questions were reaped, with TG_NOTIFY_EXPIRED=1
+    they are told the session is over."""
+    with db_session.create_session() as db:
+        tg_ids = db.scalars(select(Person.tg_id).where(Person.id.in_(person_ids))).all()
 
+    notify = os.environ.get("TG_NOTIFY_EXPIRED") == "1"
+    for tg_id in tg_ids:
+        # a new session could have started since, it is not expired yet
+        if states.get("session", tg_id) is not None:
+            continue
+        states.delete("session", tg_id)
+        if notify:
+            outbound.send_message(tg_id, "Время на ответ вышло, увидимся позже;)")
+
+
+def session_lock(tg_id: int) -> Lock:
+    return session_locks[hash(tg_id) % len(session_locks)]
+
+
+def store_session(person: Person, questions):
+    session = Session(person.id, Settings()["max_time"], Settings()["max_questions"])
+    session.generate_questions(questions)
+    states.set("session", person.tg_id, session.to_dict(), session.end_time)
+
+
+def create_session(person: Person, questions=None):
+    if questions is None:
+        questions = StatRandomGenerator().next_bunch(person, Settings()["max_questions"])
+
+    with session_lock(person.tg_id):
+        store_session(person, questions)
+    send_question(person.tg_id)
+
+
+def send_question(tg_id: int):
+    answer = None
+    with session_lock(tg_id):
+        state = states.get("session", tg_id)
+        if state is not None:
+            session = Session.from_dict(state)
+            answer = session.next_question()
+            if answer:
+                states.set("session", tg_id, session.to_dict(), session.end_time)
+            else:
+                states.delete("session", tg_id)
 
-def send_question(person: Person):
-    answer = sessions[person.tg_id].next_question()
     if answer:
         with db_session.create_session() as db:
             answer = db.merge(answer)
+            question = question_cache.get(db, answer.question_id)
 
+            old_result = answer_result(answer.state, answer.person_answer, question.answer)
             answer.state = AnswerState.TRANSFERRED
+            answer.ask_time = datetime.datetime.now()  # planned answers may be sent later than planned
+            update_stat(db, answer.person_id, answer.question_id, answer.ask_time, old_result, AnswerResult.IGNORED)
+            event = dict(person_id=answer.person_id, question_id=answer.question_id,
+                         answer_id=answer.id, result=AnswerResult.IGNORED, time=answer.ask_time)
             db.commit()
 
-            markup = InlineKeyboardMarkup()
-            options = json.loads(answer.question.options)
-            question_text = answer.question.text
-
-        buttons = []
-        for answer_index in range(len(options)):
-            question_text += '\n' + str(answer_index + 1) + '. ' + options[answer_index]
-            buttons.append(InlineKeyboardButton(answer_index + 1, callback_data='answer_' + str(answer.id) + '_' +
-                                                                                str(answer_index + 1)))
-        markup.add(*buttons, InlineKeyboardButton('Не знаю:(', callback_data='answer_' + str(answer.id) + '_0', ),
-                   row_width=len(buttons))
-
-        try:
-            bot.send_message(person.tg_id, question_text, reply_markup=markup)
-        except Exception as e:
-            pass
+        EventBus().publish("answer", **event)
+
+        outbound.send_message(tg_id, question.text, reply_markup=question.markup(event["answer_id"]))
     else:
-        bot.send_message(person.tg_id, "Ты умничка, увидимся позже;)")
+        outbound.send_message(tg_id, "Ты умничка, увидимся позже;)")
+
+
+def save_answer(answer_id: int, answer_number: int):
+    """Grades and saves the answer with one UPDATE ... RETURNING if it is still waiting for one, the answer key
+    comes from the question cache. Returns the updated row (None otherwise), its result and the rendered question.
+    Stats are updated in the same transaction."""
+    with db_session.create_session() as db:
+        # answered ones are left alone, so the old result is always ignored
+        answer = db.execute(update(QuestionAnswer).
+                            where(QuestionAnswer.id == answer_id,
+                                  QuestionAnswer.state.in_((AnswerState.TRANSFERRED, AnswerState.IGNORED))).
+                            values(person_answer=answer_number, state=AnswerState.ANSWERED,
+                                   answer_time=datetime.datetime.now()).
+                            returning(QuestionAnswer.person_id, QuestionAnswer.question_id,
+                                      QuestionAnswer.ask_time, QuestionAnswer.answer_time).
+                            execution_options(synchronize_session=False)).one_or_none()
+        if answer is None:
+            return None, None, None
+
+        question = question_cache.get(db, answer.question_id)
+        result = AnswerResult.CORRECT if answer_number == question.answer else AnswerResult.INCORRECT
+        update_stat(db, answer.person_id, answer.question_id, answer.ask_time, AnswerResult.IGNORED, result)
+        db.commit()
+
+    return answer, result, question
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('answer'))
 def check_answer(call: CallbackQuery):
-    with db_session.create_session() as db:
-        _, answer_id, answer_number = call.data.split('_')
-        cur_answer = db.get(QuestionAnswer, int(answer_id))
+    """Replies go through the outbound queue and the next question is sent from the session workers.
+    Repeated presses of the same answer's buttons are only acknowledged."""
+    _, answer_id, answer_number = call.data.split('_')
+    answer_id = int(answer_id)
+    if not handled_answers.add(answer_id):
+        bot.answer_callback_query(call.id, "Ответ уже принят")
+        return
+
+    try:
+        answer, result, question = save_answer(answer_id, int(answer_number))
+    except Exception:
+        handled_answers.discard(answer_id)
+        raise
+    if answer is None:
+        bot.answer_callback_query(call.id, "Ответ уже принят")
+        return
+
+    outbound.edit_message_reply_markup(call.from_user.id, call.message.id, reply_markup=None)
+    if result == AnswerResult.CORRECT:
+        outbound.send_message(call.message.chat.id, 'Юхуууу, правильный ответ, ты умнииичка',
+                              reply_to_message_id=call.message.id)
+        outbound.send_sticker(call.message.chat.id,
+                              stickers["right_answer"][random.randint(0, len(stickers['right_answer']) - 1)])
+    else:
+        outbound.send_message(call.message.chat.id, question.wrong_answer_text,
+                              reply_to_message_id=call.message.id)
+        outbound.send_sticker(call.from_user.id,
+                              stickers["wrong_answer"][random.randint(0, len(stickers['wrong_answer']) - 1)])
+
+    EventBus().publish("answer", person_id=answer.person_id, question_id=answer.question_id,
+                       answer_id=answer_id, result=result, time=answer.answer_time)
+
+    session_workers.put(call.from_user.id, call.from_user.id)
 
-        bot.edit_message_reply_markup(call.from_user.id, call.message.id, reply_markup=None)
-        if answer_number == str(cur_answer.question.answer):
-            bot.reply_to(call.message, 'Юхуууу, правильный ответ, ты умнииичка')
-            bot.send_sticker(call.message.chat.id,
-                             stickers["right_answer"][random.randint(0, len(stickers['right_answer']) - 1)])
-        else:
-            if cur_answer.question.article_url:
-                bot.reply_to(call.message,
-                             'Как жаль, ответ неправильный. Правильный ответ - \"'
-                             + json.loads(cur_answer.question.options)[cur_answer.question.answer - 1]
-                             + '\". Вот тебе интересная статья по этой теме.'
-                             + '\n' + cur_answer.question.article_url)
-                bot.send_sticker(call.from_user.id,
-                                 stickers["wrong_answer"][random.randint(0, len(stickers['wrong_answer']) - 1)])
-            else:
-                bot.reply_to(call.message, 'Увы, ответ неправильный, не грустите. '
-                                           'Правильный ответ \"' + json.loads(cur_answer.question.options)
-                             [cur_answer.question.answer - 1] + "\"")
-                bot.send_sticker(call.from_user.id,
-                                 stickers["wrong_answer"][random.randint(0, len(stickers['wrong_answer']) - 1)])
-
-        if cur_answer is not None:
-            cur_answer.person_answer = int(answer_number)
-            cur_answer.state = AnswerState.ANSWERED
-            cur_answer.answer_time = datetime.datetime.now()
-            db.commit()
 
-        person = db.scalar(select(Person).where(Person.tg_id == call.from_user.id))
-        send_question(person)
+def start_bot(mode=None):
+    """Starts receiving updates, by long polling or, in "webhook" mode, on a local HTTP endpoint
+    (TG_WEBHOOK_LISTEN) that TG_WEBHOOK_URL is registered to lead to."""
+    outbound.start()
+    session_workers.start()
+    SessionReaper(close_expired, lambda: Settings()["max_time"],
+                  interval=int(os.environ.get("TG_REAPER_INTERVAL", 30))).start()
 
+    if (mode or os.environ.get("TG_MODE", "polling")) == "webhook":
+        bot.threaded = False
+        dispatcher = UpdateDispatcher(bot, workers=int(os.environ.get("TG_UPDATE_WORKERS", 8))).start()
+        host, port = os.environ.get("TG_WEBHOOK_LISTEN", "127.0.0.1:8080").rsplit(":", 1)
+        secret = os.environ.get("TG_WEBHOOK_SECRET")
+        server = WebhookServer((host, int(port)), dispatcher, secret)
+
+        if os.environ.get("TG_WEBHOOK_URL"):
+            bot.set_webhook(os.environ["TG_WEBHOOK_URL"], secret_token=secret)
+
+        bot_th = Thread(target=server.serve_forever, daemon=True)
+    else:
+        bot_th = Thread(target=bot.infinity_polling, daemon=True)
 
-def start_bot():
-    bot_th = Thread(target=bot.infinity_polling, daemon=True)
     bot_th.start()
     return bot
@@ -3,13 +3,14 @@ import datetime
 from typing import Optional
 
 import numpy as np
-from sqlalchemy import select, func, or_
+from sqlalchemy import select, func
 
 from tools import Settings
 
 from models import db_session
-from models.questions import Question, QuestionAnswer, AnswerState
-from models.users import Person, PersonGroup, PersonGroupAssociation
+from models.questions import Question, QuestionAnswer, AnswerState, QuestionGroupAssociation
+from models.stats import PersonQuestionStat
+from models.users import Person, PersonGroupAssociation
 
 
 class GeneratorInterface(abc.ABC):
@@ -17,136 +18,226 @@ class GeneratorInterface(abc.ABC):
     def next_bunch(self, person: Person, count=1) -> list[Question | QuestionAnswer]:
         pass
 
+    def next_bunches(self, persons: list[Person], count=1) -> dict[int, list[Question | QuestionAnswer]]:
+        """Generates bunches for the whole cohort, returns them by person id.
+        Generators should override it with set-based queries."""
+        return {person.id: self.next_bunch(person, count) for person in persons}
+
     @staticmethod
-    def _get_planned(db, person: Person) -> list[QuestionAnswer]:
-        return db.scalars(select(QuestionAnswer).
-                          where(QuestionAnswer.person_id == person.id,
-                                QuestionAnswer.ask_time <= datetime.datetime.now(),
-                                QuestionAnswer.state == AnswerState.NOT_ANSWERED).
-                          order_by(QuestionAnswer.ask_time)).all()
+    def _get_planned(db, persons: list[Person]) -> dict[int, list[QuestionAnswer]]:
+        planned = {person.id: [] for person in persons}
+        for answer in db.scalars(select(QuestionAnswer).
+                                 where(QuestionAnswer.person_id.in_(planned.keys()),
+                                       QuestionAnswer.ask_time <= datetime.datetime.now(),
+                                       QuestionAnswer.state == AnswerState.NOT_ANSWERED).
+                                 order_by(QuestionAnswer.ask_time)):
+            planned[answer.person_id].append(answer)
+
+        return planned
 
     @staticmethod
-    def _get_person_questions(db, person: Person, planned: list[QuestionAnswer]) -> list[Question]:
-        return db.scalars(select(Question).
-                          join(Question.groups).
-                          where(PersonGroup.id.in_(pg.id for pg in person.groups),
-                                Question.id.notin_(qa.question_id for qa in planned)).
-                          group_by(Question.id)).all()
+    def _get_persons_questions(db, persons: list[Person],
+                               planned: dict[int, list[QuestionAnswer]]) -> dict[int, list[Question]]:
+        """Questions of the persons' groups except the planned ones, ordered by id."""
+        person_ids = [person.id for person in persons]
+        pairs = db.execute(select(PersonGroupAssociation.person_id, QuestionGroupAssociation.question_id).
+                           join(QuestionGroupAssociation,
+                                QuestionGroupAssociation.group_id == PersonGroupAssociation.group_id).
+                           where(PersonGroupAssociation.person_id.in_(person_ids)).
+                           distinct().
+                           order_by(QuestionGroupAssociation.question_id)).all()
+
+        questions = {q.id: q for q in db.scalars(select(Question).
+                                                 where(Question.id.in_({question_id for _, question_id in pairs})))}
+
+        persons_questions = {person_id: [] for person_id in person_ids}
+        planned_ids = {person_id: {qa.question_id for qa in answers} for person_id, answers in planned.items()}
+        for person_id, question_id in pairs:
+            if question_id not in planned_ids[person_id]:
+                persons_questions[person_id].append(questions[question_id])
+
+        return persons_questions
 
 
 class SimpleRandomGenerator(GeneratorInterface):
     def next_bunch(self, person: Person, count=1) -> list[Question | QuestionAnswer]:
+        return self.next_bunches([person], count)[person.id]
+
+    def next_bunches(self, persons: list[Person], count=1) -> dict[int, list[Question | QuestionAnswer]]:
         with db_session.create_session() as db:
-            planned = self._get_planned(db, person)
-            if len(planned) >= count:
-                return planned[:count]
+            planned = self._get_planned(db, persons)
+            persons_questions = self._get_persons_questions(db, persons, planned)
+
+        bunches = {}
+        for person in persons:
+            person_planned = planned[person.id]
+            if len(person_planned) >= count:
+                bunches[person.id] = person_planned[:count]
+                continue
 
-            person_questions = self._get_person_questions(db, person, planned)
+            person_questions = persons_questions[person.id]
+            questions = np.random.choice(person_questions,
+                                         size=min(count - len(person_planned), len(person_questions)),
+                                         replace=False)
 
-        questions = np.random.choice(person_questions,
-                                     size=min(count - len(planned), len(person_questions)),
-                                     replace=False)
+            bunches[person.id] = list(person_planned) + list(questions)
 
-        return list(planned) + list(questions)
+        return bunches
 
 
 class StatRandomGenerator(GeneratorInterface):
     def next_bunch(self, person: Person, count=1) -> list[Question | QuestionAnswer]:
+        return self.next_bunches([person], count)[person.id]
+
+    def next_bunches(self, persons: list[Person], count=1) -> dict[int, list[Question | QuestionAnswer]]:
         with db_session.create_session() as db:
-            planned = self._get_planned(db, person)
-            if len(planned) >= count:
-                return planned[:count]
-
-            person_questions = self._get_person_questions(db, person, planned)
-            probabilities = np.ones(len(person_questions))
-
-            if not person_questions:
-                return planned[:count]
-
-            for i, question in enumerate(person_questions):
-                question: Question
-                correct_count = db.scalar(select(func.count(QuestionAnswer.id)).
-                                          join(QuestionAnswer.question).
-                                          where(QuestionAnswer.person_id == person.id,
-                                                QuestionAnswer.question_id == question.id,
-                                                QuestionAnswer.person_answer == Question.answer))
-
-                if correct_count:
-                    last_correct_or_ignored = db.scalar(select(QuestionAnswer).
-                                                        join(QuestionAnswer.question).
-                                                        where(QuestionAnswer.person_id == person.id,
-                                                              QuestionAnswer.question_id == question.id,
-                                                              or_(QuestionAnswer.person_answer == Question.answer,
-                                                                  QuestionAnswer.state != AnswerState.NOT_ANSWERED)).
-                                                        order_by(QuestionAnswer.ask_time.desc()))
-
-                    first_answer = db.scalar(select(QuestionAnswer).
-                                             where(QuestionAnswer.person_id == person.id,
-                                                   QuestionAnswer.question_id == question.id))
-
-                    periods_count = (datetime.datetime.now() - first_answer.ask_time) / Settings()["time_period"]
-
-                    max_target_level = db.scalar(select(func.max(PersonGroupAssociation.target_level)).
-                                                 where(PersonGroupAssociation.person_id == person.id,
-                                                       PersonGroupAssociation.group_id.in_(
-                                                           q.id for q in question.groups)))
-
-                    p = (datetime.datetime.now() - last_correct_or_ignored.ask_time).total_seconds() / correct_count
-                    p *= np.abs(np.cos(np.pi * np.log2(periods_count + 4))) ** (
-                            ((periods_count + 4) ** 2) / 20) + 0.001  # planning questions
-                    p *= np.e ** (-0.5 * (max_target_level - question.level) ** 2)  # normal by level
-
-                    probabilities[i] = p
-                else:
-                    probabilities[i] = None
-
-        with_val = list(filter(lambda x: not np.isnan(x), probabilities))
-        without_val_count = len(person_questions) - len(with_val)
-
-        if with_val:
-            increased_avg = (sum(with_val) + without_val_count * max(with_val)) / len(person_questions)
+            planned = self._get_planned(db, persons)
+            persons_questions = self._get_persons_questions(db, persons, planned)
+            stat = self._get_questions_stat(db, [person for person in persons if len(planned[person.id]) < count])
+
+        now = datetime.datetime.now()
+        bunches = {}
+        for person in persons:
+            person_planned = planned[person.id]
+            person_questions = persons_questions[person.id]
+            if len(person_planned) >= count or not person_questions:
+                bunches[person.id] = person_planned[:count]
+                continue
+
+            person_stat = self._get_person_stat(stat, person, person_questions)
+            probabilities = self._get_probabilities(person_stat, now, Settings()["time_period"])
+
+            questions = np.random.choice(person_questions,
+                                         p=probabilities,
+                                         size=min(count - len(person_planned), len(person_questions)),
+                                         replace=False)
+
+            bunches[person.id] = list(person_planned) + list(questions)
+
+        return bunches
+
+    @staticmethod
+    def _get_questions_stat(db, persons: list[Person]) -> dict[tuple[int, int], tuple]:
+        """Loads the history of every person for each of their questions from the stats table.
+        Rows are keyed by (person_id, question_id)."""
+        if not persons:
+            return {}
+
+        person_ids = [person.id for person in persons]
+        target_levels = (select(PersonGroupAssociation.person_id,
+                                QuestionGroupAssociation.question_id,
+                                func.max(PersonGroupAssociation.target_level).label("max_target_level")).
+                         join(PersonGroupAssociation,
+                              PersonGroupAssociation.group_id == QuestionGroupAssociation.group_id).
+                         where(PersonGroupAssociation.person_id.in_(person_ids)).
+                         group_by(PersonGroupAssociation.person_id, QuestionGroupAssociation.question_id)).subquery()
+
+        rows = db.execute(select(target_levels.c.person_id, Question.id, Question.level,
+                                 target_levels.c.max_target_level,
+                                 PersonQuestionStat.correct_count, PersonQuestionStat.first_ask,
+                                 PersonQuestionStat.last_ask).
+                          join(target_levels, target_levels.c.question_id == Question.id).
+                          outerjoin(PersonQuestionStat, (PersonQuestionStat.question_id == Question.id) &
+                                    (PersonQuestionStat.person_id == target_levels.c.person_id)))
+
+        return {(row.person_id, row.id): row for row in rows}
+
+    @staticmethod
+    def _get_person_stat(stat: dict[tuple[int, int], tuple], person: Person,
+                         questions: list[Question]) -> dict[str, np.ndarray]:
+        """Arrays aligned with questions, missing times are NaN timestamps."""
+
+        def timestamp(value: Optional[datetime.datetime]) -> float:
+            return value.timestamp() if value is not None else np.nan
+
+        rows = [stat[person.id, q.id] for q in questions]
+        return {"correct_count": np.array([r.correct_count or 0 for r in rows], dtype=float),
+                "first_ask": np.array([timestamp(r.first_ask) for r in rows], dtype=float),
+                "last_ask": np.array([timestamp(r.last_ask) for r in rows], dtype=float),
+                "level": np.array([r.level for r in rows], dtype=float),
+                "max_target_level": np.array([r.max_target_level for r in rows], dtype=float)}
+
+    @staticmethod
+    def _get_probabilities(stat: dict[str, np.ndarray], now: datetime.datetime,
+                           time_period: datetime.timedelta) -> np.ndarray:
+        """Vectorized weighting of the questions, never answered correctly ones get an increased average."""
+        answered = stat["correct_count"] > 0
+        now = now.timestamp()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            periods_count = (now - stat["first_ask"]) / time_period.total_seconds()
+
+            probabilities = (now - stat["last_ask"]) / stat["correct_count"]
+            probabilities *= np.abs(np.cos(np.pi * np.log2(periods_count + 4))) ** (
+                    ((periods_count + 4) ** 2) / 20) + 0.001  # planning questions
+            probabilities *= np.e ** (-0.5 * (stat["max_target_level"] - stat["level"]) ** 2)  # normal by level
+
+        probabilities[~answered] = np.nan
+
+        with_val = probabilities[~np.isnan(probabilities)]
+        without_val_count = len(probabilities) - len(with_val)
+
+        if len(with_val):
+            increased_avg = (with_val.sum() + without_val_count * with_val.max()) / len(probabilities)
         else:
             increased_avg = 1
 
         probabilities[np.isnan(probabilities)] = increased_avg
-        probabilities /= sum(probabilities)
-
-        questions = np.random.choice(person_questions,
-                                     p=probabilities,
-                                     size=min(count - len(planned), len(person_questions)),
-                                     replace=False)
-
-        return list(planned) + list(questions)
+        return probabilities / probabilities.sum()
 
 
 class Session:
-    def __init__(self, person: Person, max_time, max_questions):
-        self.person = person
+    """Questions left in a person's session, only ids are kept so it can be stored between updates."""
+
+    def __init__(self, person_id: int, max_time: datetime.timedelta, max_questions: int,
+                 items: Optional[list[tuple[str, int]]] = None, start_time: Optional[datetime.datetime] = None):
+        self.person_id = person_id
         self.max_time = max_time
         self.max_questions = max_questions
 
-        self._questions: list[QuestionAnswer] = []
+        # ("question", id) is asked as a new answer, ("answer", id) is a planned answer
+        self._items: list[tuple[str, int]] = list(items or [])
+        self._start_time = start_time or datetime.datetime.now()
+
+    def generate_questions(self, questions: list[Question | QuestionAnswer]):
+        self._items = [("question", q.id) if isinstance(q, Question) else ("answer", q.id) for q in questions]
         self._start_time = datetime.datetime.now()
 
-        self.generator = StatRandomGenerator()
+    def add_planned(self, answers: list[QuestionAnswer]):
+        """Puts the planned answers first, so they are asked right after the current question."""
+        planned = [("answer", a.id) for a in answers]
+        self._items = planned + [item for item in self._items if item not in planned]
 
-    def generate_questions(self):
-        self._questions = self.generator.next_bunch(self.person, self.max_questions)
-        self._start_time = datetime.datetime.now()
+    @property
+    def end_time(self) -> datetime.datetime:
+        return self._start_time + self.max_time
 
     def next_question(self) -> Optional[QuestionAnswer]:
-        if not self._questions or self._start_time + self.max_time < datetime.datetime.now():
+        if not self._items or self.end_time < datetime.datetime.now():
             return None
 
-        cur_answer = cur_question = self._questions.pop(0)
+        kind, item_id = self._items.pop(0)
         with db_session.create_session() as db:
-            if isinstance(cur_question, Question):
-                cur_answer = QuestionAnswer(question_id=cur_question.id,
-                                            person_id=self.person.id,
-                                            ask_time=datetime.datetime.now(),
-                                            state=AnswerState.NOT_ANSWERED)
-
-                db.add(cur_answer)
-                db.commit()
-
+            if kind == "answer":
+                return db.get(QuestionAnswer, item_id)
+
+            cur_answer = QuestionAnswer(question_id=item_id,
+                                        person_id=self.person_id,
+                                        ask_time=datetime.datetime.now(),
+                                        state=AnswerState.NOT_ANSWERED)
+            db.add(cur_answer)
+            db.commit()
+            db.refresh(cur_answer)
             return cur_answer
+
+    def to_dict(self) -> dict:
+        return {"person_id": self.person_id,
+                "max_time": self.max_time.total_seconds(),
+                "max_questions": self.max_questions,
+                "items": self._items,
+                "start_time": self._start_time.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        return cls(data["person_id"], datetime.timedelta(seconds=data["max_time"]), data["max_questions"],
+                   [tuple(item) for item in data["items"]], datetime.datetime.fromisoformat(data["start_time"]))
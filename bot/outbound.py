@@ -0,0 +1,106 @@
+import collections
+import logging
+import threading
+import time
+
+from requests import RequestException
+from telebot.apihelper import ApiTelegramException
+
+from .workers import ShardedWorkers
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds the caller has to wait before using it."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class OutboundQueue:
+    """Sends bot API calls from a pool of workers. Calls for the same chat always go to the same
+    worker, so they are delivered in order. Telegram allows about 30 messages per second
+    overall and about one per second in a chat, both limits are enforced with token buckets."""
+
+    def __init__(self, bot, workers=4, max_size=1000, global_rate=30, chat_rate=1, chat_burst=4,
+                 max_retries=5, clock=time.monotonic, sleep=time.sleep):
+        self.bot = bot
+        self.max_retries = max_retries
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+        self._clock = clock
+        self._sleep = sleep
+        self._global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self._workers = ShardedWorkers(self._handle, workers, max_size, "outbound")
+
+    def start(self):
+        self._workers.start()
+        return self
+
+    def stop(self):
+        self._workers.stop()
+
+    def join(self):
+        """Blocks until everything queued so far was sent or dropped."""
+        self._workers.join()
+
+    def call(self, method: str, chat_id: int, *args, **kwargs):
+        """Queues bot.<method>(chat_id, *args, **kwargs), blocks while the worker's queue is full."""
+        self._workers.put(chat_id, (method, chat_id, args, kwargs))
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        self.call("send_message", chat_id, text, **kwargs)
+
+    def send_sticker(self, chat_id: int, sticker: str, **kwargs):
+        self.call("send_sticker", chat_id, sticker, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id: int, message_id: int, **kwargs):
+        self.call("edit_message_reply_markup", chat_id, message_id, **kwargs)
+
+    def _handle(self, item, state: dict):
+        method, chat_id, args, kwargs = item
+        chat_buckets = state.setdefault("chat_buckets", collections.OrderedDict())
+        if chat_id not in chat_buckets:
+            chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, self._clock)
+            if len(chat_buckets) > 10_000:
+                chat_buckets.popitem(last=False)
+        chat_buckets.move_to_end(chat_id)
+
+        self._send(chat_buckets[chat_id], method, chat_id, args, kwargs)
+
+    def _send(self, chat_bucket: TokenBucket, method: str, chat_id: int, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._sleep(max(chat_bucket.reserve(), self._global_bucket.reserve()))
+
+            try:
+                getattr(self.bot, method)(chat_id, *args, **kwargs)
+                return
+            except ApiTelegramException as e:
+                if e.error_code != 429:
+                    logger.warning("%s to %s failed: %s", method, chat_id, e)
+                    return
+                delay = (e.result_json.get("parameters") or {}).get("retry_after", 2 ** attempt)
+            except RequestException as e:
+                logger.warning("%s to %s failed: %s", method, chat_id, e)
+                delay = 2 ** attempt
+            except Exception:
+                logger.exception("%s to %s failed", method, chat_id)
+                return
+
+            self._sleep(delay)
+
+        logger.error("%s to %s dropped after %s retries", method, chat_id, self.max_retries)
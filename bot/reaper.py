@@ -0,0 +1,59 @@
+import datetime
+import logging
+import threading
+from typing import Callable
+
+from sqlalchemy import update
+
+from models import db_session
+from models.questions import QuestionAnswer, AnswerState
+
+logger = logging.getLogger(__name__)
+
+
+class SessionReaper:
+    """Closes the questions nobody answered in time. Every interval the transferred answers asked more than
+    max_time ago are marked ignored by one UPDATE over the (state, ask_time) index, and the callback gets
+    the ids of their persons. Ignored answers count as ignored in the stats already, so those are left as is."""
+
+    def __init__(self, callback: Callable[[list[int]], None], max_time: Callable[[], datetime.timedelta],
+                 interval=30, clock=datetime.datetime.now):
+        self.callback = callback
+        self.max_time = max_time
+        self.interval = interval
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reap(self) -> list[int]:
+        """Marks the expired answers ignored, returns the ids of the persons they were asked."""
+        with db_session.create_session() as db:
+            person_ids = db.scalars(update(QuestionAnswer).
+                                    where(QuestionAnswer.state == AnswerState.TRANSFERRED,
+                                          QuestionAnswer.ask_time < self._clock() - self.max_time()).
+                                    values(state=AnswerState.IGNORED).
+                                    returning(QuestionAnswer.person_id).
+                                    execution_options(synchronize_session=False)).all()
+            db.commit()
+
+        return sorted(set(person_ids))
+
+    def _work(self):
+        while not self._stop.wait(self.interval):
+            try:
+                person_ids = self.reap()
+                if person_ids:
+                    self.callback(person_ids)
+            except Exception:
+                logger.exception("Reaping expired sessions failed")
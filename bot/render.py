@@ -0,0 +1,76 @@
+import collections
+import json
+import threading
+
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from models.questions import Question
+
+_ANSWER_ID = "%ANSWER_ID%"
+
+
+class RenderedQuestion:
+    """Everything the bot sends about a question, prepared once."""
+
+    def __init__(self, question: Question):
+        self.question_id = question.id
+        self.answer = question.answer
+        self.options = json.loads(question.options)
+        self.article_url = question.article_url
+
+        self.text = question.text + "".join(f"\n{i + 1}. {option}" for i, option in enumerate(self.options))
+
+        correct_option = self.options[self.answer - 1] if 0 < self.answer <= len(self.options) else ""
+        if self.article_url:
+            self.wrong_answer_text = 'Как жаль, ответ неправильный. Правильный ответ - "' + correct_option + \
+                                     '". Вот тебе интересная статья по этой теме.\n' + self.article_url
+        else:
+            self.wrong_answer_text = 'Увы, ответ неправильный, не грустите. Правильный ответ "' + correct_option + '"'
+
+        # The keyboard is serialized once, send_message accepts the json string as reply_markup
+        markup = InlineKeyboardMarkup()
+        buttons = [InlineKeyboardButton(i + 1, callback_data=f"answer_{_ANSWER_ID}_{i + 1}")
+                   for i in range(len(self.options))]
+        markup.add(*buttons, InlineKeyboardButton('Не знаю:(', callback_data=f"answer_{_ANSWER_ID}_0"),
+                   row_width=max(len(buttons), 1))
+        self._markup = markup.to_json()
+
+    def markup(self, answer_id: int) -> str:
+        return self._markup.replace(_ANSWER_ID, str(answer_id))
+
+
+class QuestionCache:
+    """Process-wide LRU of rendered questions. Subscribed to the "question_changed" event,
+    which the web panel publishes when a question is edited or deleted."""
+
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0  # changes on every invalidation, so a render racing with it isn't stored
+
+    def get(self, db, question_id: int) -> RenderedQuestion:
+        with self._lock:
+            if question_id in self._items:
+                self._items.move_to_end(question_id)
+                return self._items[question_id]
+            generation = self._generation
+
+        rendered = RenderedQuestion(db.get(Question, question_id))
+
+        with self._lock:
+            if generation != self._generation:
+                return rendered
+            self._items[question_id] = rendered
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return rendered
+
+    def invalidate(self, question_id=None, **_):
+        """Drops one question, or everything if no id is given."""
+        with self._lock:
+            self._generation += 1
+            if question_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(question_id, None)
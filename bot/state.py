@@ -0,0 +1,138 @@
+import abc
+import collections
+import datetime
+import json
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db_session
+from models.states import ConversationState
+
+
+class StateStore(abc.ABC):
+    """Conversation state of the bot by kind ("session", "registration") and telegram id.
+    Values are json-serializable dicts of ids, every one is dropped after its expiry time."""
+
+    @abc.abstractmethod
+    def get(self, kind: str, key: int) -> Optional[dict]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, kind: str, key: int, value: dict, expires_at: datetime.datetime):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, kind: str, key: int):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """LRU with expiry, the states are lost on restart."""
+
+    def __init__(self, max_size=10_000, clock=datetime.datetime.now):
+        self.max_size = max_size
+        self._clock = clock
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, key: int) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get((kind, key))
+            if item is None:
+                return None
+            if item[1] <= self._clock():
+                del self._items[(kind, key)]
+                return None
+            self._items.move_to_end((kind, key))
+            return json.loads(item[0])
+
+    def set(self, kind: str, key: int, value: dict, expires_at: datetime.datetime):
+        with self._lock:
+            self._items[(kind, key)] = (json.dumps(value), expires_at)
+            self._items.move_to_end((kind, key))
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, kind: str, key: int):
+        with self._lock:
+            self._items.pop((kind, key), None)
+
+
+class SqliteStateStore(StateStore):
+    """Keeps the states in the conversation_states table, so they survive a restart.
+    Expired rows are purged every purge_every writes."""
+
+    def __init__(self, purge_every=1000, clock=datetime.datetime.now):
+        self.purge_every = purge_every
+        self._clock = clock
+        self._writes = 0
+
+    def get(self, kind: str, key: int) -> Optional[dict]:
+        with db_session.create_session() as db:
+            value = db.scalar(select(ConversationState.value).
+                              where(ConversationState.kind == kind,
+                                    ConversationState.key == key,
+                                    ConversationState.expires_at > self._clock()))
+        return json.loads(value) if value is not None else None
+
+    def set(self, kind: str, key: int, value: dict, expires_at: datetime.datetime):
+        table = ConversationState.__table__
+        with db_session.create_session() as db:
+            db.execute(sqlite_insert(table).
+                       values(kind=kind, key=key, value=json.dumps(value), expires_at=expires_at).
+                       on_conflict_do_update(index_elements=[table.c.kind, table.c.key],
+                                             set_={"value": json.dumps(value), "expires_at": expires_at}))
+            db.commit()
+
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge()
+
+    def delete(self, kind: str, key: int):
+        with db_session.create_session() as db:
+            db.execute(delete(ConversationState).
+                       where(ConversationState.kind == kind, ConversationState.key == key))
+            db.commit()
+
+    def purge(self):
+        with db_session.create_session() as db:
+            db.execute(delete(ConversationState).where(ConversationState.expires_at <= self._clock()))
+            db.commit()
+
+
+class RecentIds:
+    """Bounded set of the latest ids, the oldest are forgotten first."""
+
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, item_id: int) -> bool:
+        """Remembers the id, returns False if it is already there."""
+        with self._lock:
+            if item_id in self._items:
+                self._items.move_to_end(item_id)
+                return False
+            self._items[item_id] = None
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+            return True
+
+    def discard(self, item_id: int):
+        with self._lock:
+            self._items.pop(item_id, None)
+
+
+def create_store(kind=None) -> StateStore:
+    """The store selected by the TG_STATE_STORE variable, "sqlite" (default) or "memory"."""
+    kind = kind or os.environ.get("TG_STATE_STORE", "sqlite")
+    if kind == "memory":
+        return MemoryStateStore()
+    if kind == "sqlite":
+        return SqliteStateStore()
+    raise ValueError(f"Unknown state store: {kind}")
@@ -0,0 +1,87 @@
+import hmac
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+from telebot.types import Update
+
+from .workers import ShardedWorkers
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: Update) -> int:
+    """The chat the update belongs to, updates of one chat are handled by the same worker."""
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    return update.update_id
+
+
+class UpdateDispatcher:
+    """Runs the bot handlers on a pool of workers. Updates of the same chat always go to the same worker,
+    so they are handled one by one in the order they came. The bot has to be non-threaded."""
+
+    def __init__(self, bot, workers=8, max_size=1000):
+        self.bot = bot
+        self._workers = ShardedWorkers(self._handle, workers, max_size, "updates")
+
+    def start(self):
+        self._workers.start()
+        return self
+
+    def stop(self):
+        self._workers.stop()
+
+    def join(self):
+        """Blocks until everything queued so far was handled."""
+        self._workers.join()
+
+    def put(self, update: Update):
+        """Queues the update, blocks while the worker's queue is full."""
+        self._workers.put(update_chat_id(update), update)
+
+    def _handle(self, update: Update, state: dict):
+        try:
+            self.bot.process_new_updates([update])
+        except Exception:
+            logger.exception("Update %s failed", update.update_id)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Local HTTP endpoint Telegram posts the updates to, normally behind a TLS reverse proxy.
+    With a secret, requests without the matching X-Telegram-Bot-Api-Secret-Token header are rejected."""
+
+    daemon_threads = True
+    request_queue_size = 128  # the listen backlog, the default 5 resets connections in a burst
+
+    def __init__(self, address: tuple[str, int], dispatcher: UpdateDispatcher, secret: Optional[str] = None):
+        super().__init__(address, _WebhookHandler)
+        self.dispatcher = dispatcher
+        self.secret = secret
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def do_POST(self):
+        secret = self.server.secret
+        if secret and not hmac.compare_digest(self.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+            self.send_error(403)
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            update = Update.de_json(body.decode("utf-8"))
+        except Exception:
+            self.send_error(400)
+            return
+
+        self.server.dispatcher.put(update)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
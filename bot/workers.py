@@ -0,0 +1,57 @@
+import logging
+import queue
+import threading
+from typing import Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedWorkers:
+    """A pool of threads with a bounded queue each. Items put with the same key always go to the same worker,
+    so they are handled one by one in the order they were put. handler(item, state) is called for every item,
+    state is a dict the worker keeps between its items."""
+
+    def __init__(self, handler: Callable[[object, dict], None], workers=4, max_size=1000, name="worker"):
+        self._handler = handler
+        self._name = name
+        self._queues = [queue.Queue(max(1, max_size // workers)) for _ in range(workers)]
+        self._threads = []
+
+    def start(self):
+        for i, worker_queue in enumerate(self._queues):
+            th = threading.Thread(target=self._work, args=(worker_queue,), name=f"{self._name}-{i}", daemon=True)
+            th.start()
+            self._threads.append(th)
+        return self
+
+    def stop(self):
+        """Handles what is already queued and stops the workers."""
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        for th in self._threads:
+            th.join()
+        self._threads.clear()
+
+    def join(self):
+        """Blocks until everything queued so far was handled."""
+        for worker_queue in self._queues:
+            worker_queue.join()
+
+    def put(self, key: Hashable, item):
+        """Queues the item on the worker of the key, blocks while its queue is full."""
+        self._queues[hash(key) % len(self._queues)].put(item)
+
+    def _work(self, worker_queue: queue.Queue):
+        state = {}
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                worker_queue.task_done()
+                return
+
+            try:
+                self._handler(item, state)
+            except Exception:
+                logger.exception("%s failed to handle %r", self._name, item)
+            finally:
+                worker_queue.task_done()
@@ -0,0 +1,92 @@
+import logging
+import threading
+from multiprocessing.connection import Listener, Client, Connection
+
+from tools import EventBus
+
+logger = logging.getLogger(__name__)
+
+# Events the roles of main.py exchange. The web panel publishes settings_changed, question_planned and
+# question_changed, the bot publishes answer, the scheduler publishes sessions_due and planned_due.
+BRIDGED_TOPICS = ("settings_changed", "question_planned", "question_changed", "answer", "sessions_due", "planned_due")
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class Hub:
+    """Relays every event a process sends to all the other connected processes."""
+
+    def __init__(self, address: str, authkey: bytes):
+        self._listener = Listener(parse_address(address), authkey=authkey)
+        self._connections = {}  # connection -> lock for sending to it
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                return
+            except Exception:
+                logger.exception("IPC connection failed")
+                continue
+
+            with self._lock:
+                self._connections[connection] = threading.Lock()
+            threading.Thread(target=self._read, args=(connection,), daemon=True).start()
+
+    def _read(self, connection: Connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                others = [(c, lock) for c, lock in self._connections.items() if c is not connection]
+            for other, lock in others:
+                try:
+                    with lock:
+                        other.send(message)
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._connections.pop(connection, None)
+        connection.close()
+
+
+def connect(address: str, authkey: bytes, topics=BRIDGED_TOPICS) -> Connection:
+    """Sends the local events of the topics to the hub and publishes the events of the other processes locally."""
+    connection = Client(parse_address(address), authkey=authkey)
+    lock = threading.Lock()
+    bus = EventBus()
+
+    def forward(topic, **payload):
+        if topic in topics:
+            with lock:
+                connection.send((topic, payload))
+
+    def read():
+        while True:
+            try:
+                topic, payload = connection.recv()
+            except (EOFError, OSError):
+                logger.error("IPC hub connection closed")
+                return
+
+            try:
+                bus.deliver(topic, **payload)
+            except Exception:
+                logger.exception("%s handler failed", topic)
+
+    bus.add_forwarder(forward)
+    threading.Thread(target=read, daemon=True).start()
+    return connection
@@ -1,16 +1,42 @@
 import datetime
-import math
+import multiprocessing
+import os
+import sys
+import threading
 
+from gunicorn.app.base import BaseApplication
+
+import ipc
 from models import db_session
-import bot
-import schedule
-from tools import Settings, WeekDays
-from web import app as web
-from web import socketio
+from tools import Settings, WeekDays, EventBus
 
 # Environment variables
 # ADMIN_PASSWD: password for web panel
 # TGTOKEN: token for telegram bot
+# TG_SEND_WORKERS: number of threads sending telegram messages (4 by default)
+# TG_MODE: "polling" (default) or "webhook"
+# TG_WEBHOOK_LISTEN: host:port of the local webhook endpoint (127.0.0.1:8080 by default)
+# TG_WEBHOOK_URL: public url of the endpoint to register with telegram, skipped if not set
+# TG_WEBHOOK_SECRET: secret token telegram sends with every update
+# TG_UPDATE_WORKERS: number of threads handling the webhook updates (8 by default)
+# TG_SESSION_WORKERS: number of threads sending the next question after an answer, each chat uses one of them (4 by default)
+# TG_STATE_STORE: "sqlite" (default) or "memory", where the bot keeps registrations and sessions
+# TG_REAPER_INTERVAL: seconds between closing the questions not answered in max_time (30 by default)
+# TG_NOTIFY_EXPIRED: "1" to tell people their session is over when its questions are closed
+# DB_PROFILE: sqlite engine profile (see models.db_session.ENGINE_PROFILES), overrides settings
+# WEB_PORT: port of the web panel (5000 by default)
+# WEB_THREADS: number of threads serving the web panel requests and websockets (100 by default)
+# IPC_ADDRESS: host:port of the event hub the roles talk over (127.0.0.1:6001 by default)
+# IPC_AUTHKEY: key the roles authenticate to the event hub with
+
+# python main.py [web] [bot] [scheduler]
+# Starts the given roles, all of them by default, each in its own process. They share the database and
+# pass events (settings changes, planned questions, answers, due sessions) through the event hub, which
+# the first launcher starts. Roles started by another launcher on the same machine connect to it.
+
+ROLES = ("web", "bot", "scheduler")
+IPC_ADDRESS = os.environ.get("IPC_ADDRESS", "127.0.0.1:6001")
+IPC_AUTHKEY = os.environ.get("IPC_AUTHKEY", "testing_platform").encode()
 
 
 default_settings = {"tg_pin": "32266",
@@ -21,14 +47,87 @@ default_settings = {"tg_pin": "32266",
                     "week_days": [WeekDays(d) for d in range(7)],
                     "max_time": datetime.timedelta(minutes=1),
                     "max_questions": 1,
+                    "dispatch_mode": "burst",
+                    "dispatch_window": datetime.timedelta(hours=1),
+                    "db_profile": "tuned",
                     }
 
-if __name__ == '__main__':
+
+def setup():
     Settings().setup("data/settings.stg", default_settings)
-    db_session.global_init("data/database.db")
+    db_session.global_init("data/database.db", Settings()["db_profile"])
+
+
+class WebServer(BaseApplication):
+    """Gunicorn with one gthread worker: the socket.io sessions live in the worker's memory, so there can be
+    only one, and each request or websocket gets its own native thread of it."""
+
+    def load_config(self):
+        self.cfg.set("bind", f"0.0.0.0:{os.environ.get('WEB_PORT', 5000)}")
+        self.cfg.set("worker_class", "gthread")
+        self.cfg.set("workers", 1)
+        self.cfg.set("threads", int(os.environ.get("WEB_THREADS", 100)))
+
+    def load(self):
+        # runs in the worker process, the IPC reader thread wouldn't survive the fork
+        setup()
+        ipc.connect(IPC_ADDRESS, IPC_AUTHKEY)
+
+        from web import app
+        return app
+
+
+def run_web():
+    WebServer().run()
+
+
+def run_bot():
+    setup()
+    ipc.connect(IPC_ADDRESS, IPC_AUTHKEY)
+
+    import bot
+    EventBus().subscribe("sessions_due", bot.sessions_due)
+    EventBus().subscribe("planned_due", bot.planned_due)
+    bot.start_bot()
+    threading.Event().wait()
+
+
+def run_scheduler():
+    setup()
+    ipc.connect(IPC_ADDRESS, IPC_AUTHKEY)
+
+    import schedule
+    bus = EventBus()
+    schedule.Schedule(lambda persons: bus.publish("sessions_due", person_ids=[p.id for p in persons]),
+                      "data/schedule.state",
+                      lambda answers: bus.publish("planned_due", answer_ids=[a.id for a in answers])). \
+        from_settings().run()
+
+
+RUNNERS = {"web": run_web, "bot": run_bot, "scheduler": run_scheduler}
+
+if __name__ == '__main__':
+    roles = sys.argv[1:] or ROLES
+    if any(role not in RUNNERS for role in roles):
+        print(f"Usage: python main.py [{'] ['.join(ROLES)}]")
+        sys.exit(1)
+
+    # Creates and migrates the database once, before the roles open it
+    setup()
 
-    schedule.Schedule(bot.create_session).from_settings().start()
+    try:
+        hub = ipc.Hub(IPC_ADDRESS, IPC_AUTHKEY).start()
+    except OSError:
+        print(f"Event hub is already running at {IPC_ADDRESS}")
 
-    bot = bot.start_bot()
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=RUNNERS[role], name=role) for role in roles]
+    for process in processes:
+        process.start()
 
-    socketio.run(web, host="0.0.0.0", debug=True, use_reloader=False)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
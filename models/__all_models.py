@@ -1,2 +1,4 @@
 from . import users
 from . import questions
+from . import stats
+from . import states
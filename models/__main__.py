@@ -0,0 +1,20 @@
+import sys
+
+from . import db_session
+from .search import rebuild_search_index
+from .stats import rebuild_stats
+
+# python -m models rebuild_stats|rebuild_search [data/database.db]
+
+COMMANDS = {"rebuild_stats": rebuild_stats,
+            "rebuild_search": rebuild_search_index}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print("Usage: python -m models rebuild_stats|rebuild_search [database file]")
+        sys.exit(1)
+
+    db_session.global_init(sys.argv[2] if len(sys.argv) > 2 else "data/database.db")
+    with db_session.create_session() as db:
+        COMMANDS[sys.argv[1]](db)
+        db.commit()
@@ -1,3 +1,5 @@
+import os
+
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
@@ -7,8 +9,50 @@ SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
 
+# Connection pragmas and pool options, selected by name in global_init or with the DB_PROFILE variable.
+# "default" keeps sqlite's rollback journal, "tuned" lets the bot, the scheduler and the web panel
+# read while one of them writes.
+ENGINE_PROFILES = {
+    "default": {
+        "pragmas": {},
+        "pool": {},
+    },
+    "tuned": {
+        "pragmas": {"journal_mode": "WAL",
+                    "busy_timeout": 5000,
+                    "synchronous": "NORMAL",
+                    "mmap_size": 256 * 1024 * 1024,
+                    "cache_size": -64 * 1024,  # in KiB
+                    "temp_store": "MEMORY"},
+        "pool": {"poolclass": sa.pool.QueuePool,
+                 "pool_size": 10,
+                 "max_overflow": 20,
+                 "pool_timeout": 30},
+    },
+}
+
+
+def create_engine(db_file, profile="default") -> sa.Engine:
+    if profile not in ENGINE_PROFILES:
+        raise Exception(f"Неизвестный профиль базы данных: {profile}")
+
+    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
+    print(f"Подключение к базе данных по адресу {conn_str}, профиль {profile}")
+
+    engine = sa.create_engine(conn_str, echo=False, **ENGINE_PROFILES[profile]["pool"])
+    pragmas = ENGINE_PROFILES[profile]["pragmas"]
+
+    @sa.event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
 
-def global_init(db_file):
+
+def global_init(db_file, profile=None):
     global __factory
 
     if __factory:
@@ -17,15 +61,30 @@ def global_init(db_file):
     if not db_file or not db_file.strip():
         raise Exception("Необходимо указать файл базы данных.")
 
-    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
-    print(f"Подключение к базе данных по адресу {conn_str}")
-
-    engine = sa.create_engine(conn_str, echo=False)
+    engine = create_engine(db_file, os.environ.get("DB_PROFILE", profile or "tuned"))
     __factory = orm.sessionmaker(bind=engine)
 
     from . import __all_models
+    from .stats import PersonQuestionStat, rebuild_stats
+    from .search import create_search_index
+
+    stats_exist = sa.inspect(engine).has_table(PersonQuestionStat.__tablename__)
 
     SqlAlchemyBase.metadata.create_all(engine)
+    _migrate(engine)
+    create_search_index(engine)
+
+    if not stats_exist:
+        with __factory() as db:
+            rebuild_stats(db)
+            db.commit()
+
+
+def _migrate(engine):
+    """create_all() skips tables that already exist, so indexes declared later are added here."""
+    for table in SqlAlchemyBase.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 
 def create_session() -> Session:
@@ -2,7 +2,7 @@ import datetime
 import enum
 from typing import List, Optional
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import relationship, backref, mapped_column, Mapped
 from sqlalchemy_serializer import SerializerMixin
 
@@ -14,6 +14,7 @@ class AnswerState(enum.Enum):
     NOT_ANSWERED = 0
     TRANSFERRED = 1
     ANSWERED = 2
+    IGNORED = 3  # transferred, but not answered in max_time
 
 
 class QuestionGroupAssociation(SqlAlchemyBase):
@@ -38,6 +39,10 @@ class Question(SqlAlchemyBase, SerializerMixin):
 
 class QuestionAnswer(SqlAlchemyBase, SerializerMixin):
     __tablename__ = 'answers'
+    __table_args__ = (Index("ix_answers_person_question", "person_id", "question_id"),
+                      Index("ix_answers_person_state_ask_time", "person_id", "state", "ask_time"),
+                      Index("ix_answers_person_answer_time", "person_id", "answer_time"),
+                      Index("ix_answers_state_ask_time", "state", "ask_time"))
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"))
@@ -0,0 +1,71 @@
+import re
+from typing import Optional
+
+import sqlalchemy as sa
+from sqlalchemy import Table, Column, Integer, String, MetaData, select, literal_column
+
+# FTS5 shadow index over the questions. It is not a part of SqlAlchemyBase.metadata because create_all()
+# can't create virtual tables, create_search_index() makes it together with the triggers that keep it in sync.
+questions_fts = Table("questions_fts", MetaData(),
+                      Column("rowid", Integer, primary_key=True),
+                      Column("text", String),
+                      Column("subject", String),
+                      Column("options", String),
+                      Column("article_url", String),
+                      Column("rank", sa.Float))
+
+_decoded_options = "CASE WHEN json_valid({0}.options) " \
+                   "THEN (SELECT group_concat(value, ' ') FROM json_each({0}.options)) " \
+                   "ELSE {0}.options END"
+
+_insert_row = "INSERT INTO questions_fts(rowid, text, subject, options, article_url) " \
+              f"VALUES (new.id, new.text, new.subject, {_decoded_options.format('new')}, new.article_url);"
+
+_ddl = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts "
+    "USING fts5(text, subject, options, article_url, tokenize='unicode61 remove_diacritics 2')",
+
+    f"CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN {_insert_row} END",
+
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+    "DELETE FROM questions_fts WHERE rowid = old.id; END",
+
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE ON questions BEGIN "
+    f"DELETE FROM questions_fts WHERE rowid = old.id; {_insert_row} END",
+]
+
+
+def create_search_index(engine: sa.Engine):
+    """Creates the index and its triggers, fills the index if it is new."""
+    exists = sa.inspect(engine).has_table("questions_fts")
+
+    with engine.begin() as connection:
+        for statement in _ddl:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            rebuild_search_index(connection)
+
+
+def rebuild_search_index(db):
+    db.execute(sa.text("DELETE FROM questions_fts"))
+    db.execute(sa.text("INSERT INTO questions_fts(rowid, text, subject, options, article_url) "
+                       f"SELECT id, text, subject, {_decoded_options.format('questions')}, article_url "
+                       "FROM questions"))
+
+
+def match_query(search: str) -> Optional[str]:
+    """Turns the search box input into an FTS5 query: every word is a quoted prefix, all of them must match."""
+    tokens = re.findall(r"\w+", search)
+    if not tokens:
+        return None
+    return " ".join('"{}"*'.format(token) for token in tokens)
+
+
+def search_questions(search: str):
+    """Subquery of (rowid, rank) for the matching questions, or None if there is nothing to look for."""
+    query = match_query(search)
+    if query is None:
+        return None
+    return select(questions_fts.c.rowid, questions_fts.c.rank). \
+        where(literal_column("questions_fts").op("MATCH")(query)). \
+        subquery()
@@ -0,0 +1,15 @@
+import datetime
+
+from sqlalchemy.orm import mapped_column, Mapped
+
+from .db_session import SqlAlchemyBase
+
+
+class ConversationState(SqlAlchemyBase):
+    """Bot conversation state (sessions, registrations) as json, kept until expires_at."""
+    __tablename__ = "conversation_states"
+
+    kind: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[int] = mapped_column(primary_key=True)
+    value: Mapped[str]
+    expires_at: Mapped[datetime.datetime] = mapped_column(index=True)
@@ -0,0 +1,114 @@
+import datetime
+import enum
+from typing import Optional
+
+from sqlalchemy import ForeignKey, select, delete, insert, func, case, literal, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import mapped_column, Mapped
+
+from .db_session import SqlAlchemyBase
+from .questions import Question, QuestionAnswer, AnswerState
+
+
+class AnswerResult(enum.Enum):
+    NOT_ANSWERED = 0
+    IGNORED = 1
+    CORRECT = 2
+    INCORRECT = 3
+
+
+class PersonQuestionStat(SqlAlchemyBase):
+    """Materialized per-person/per-question counters, kept in sync with the answers table
+    by update_stat() and recomputed from scratch by rebuild_stats()."""
+    __tablename__ = "person_question_stats"
+
+    person_id: Mapped[int] = mapped_column(ForeignKey("persons.id"), primary_key=True)
+    question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"), primary_key=True)
+    correct_count: Mapped[int] = mapped_column(default=0)
+    incorrect_count: Mapped[int] = mapped_column(default=0)
+    ignored_count: Mapped[int] = mapped_column(default=0)
+    first_ask: Mapped[Optional[datetime.datetime]]
+    last_ask: Mapped[Optional[datetime.datetime]]
+    last_state: Mapped[AnswerResult] = mapped_column(default=AnswerResult.NOT_ANSWERED)
+
+
+_counters = {AnswerResult.CORRECT: "correct_count",
+             AnswerResult.INCORRECT: "incorrect_count",
+             AnswerResult.IGNORED: "ignored_count"}
+
+
+def answer_result(state: AnswerState, person_answer: Optional[int], correct_answer: int) -> AnswerResult:
+    if state == AnswerState.NOT_ANSWERED:
+        return AnswerResult.NOT_ANSWERED
+    if state in (AnswerState.TRANSFERRED, AnswerState.IGNORED):
+        return AnswerResult.IGNORED
+    if person_answer == correct_answer:
+        return AnswerResult.CORRECT
+    return AnswerResult.INCORRECT
+
+
+def update_stat(db, person_id: int, question_id: int, ask_time: datetime.datetime,
+                old_result: AnswerResult, new_result: AnswerResult):
+    """Applies a state change of one answer to the stats in the caller's transaction."""
+    if old_result == new_result:
+        return
+
+    table = PersonQuestionStat.__table__
+    ask_time = literal(ask_time, table.c.last_ask.type)
+    new_state = literal(new_result, table.c.last_state.type)
+
+    values = {"person_id": person_id, "question_id": question_id,
+              "correct_count": 0, "incorrect_count": 0, "ignored_count": 0,
+              "first_ask": ask_time, "last_ask": ask_time, "last_state": new_state}
+    if new_result in _counters:
+        values[_counters[new_result]] = 1
+
+    is_last = table.c.last_ask.is_(None) | (table.c.last_ask <= ask_time)
+    updates = {"first_ask": func.min(func.coalesce(table.c.first_ask, ask_time), ask_time),
+               "last_ask": case((is_last, ask_time), else_=table.c.last_ask),
+               "last_state": case((is_last, new_state), else_=table.c.last_state)}
+    if old_result in _counters:
+        updates[_counters[old_result]] = table.c[_counters[old_result]] - 1
+    if new_result in _counters:
+        updates[_counters[new_result]] = table.c[_counters[new_result]] + 1
+
+    db.execute(sqlite_insert(table).values(values).
+               on_conflict_do_update(index_elements=[table.c.person_id, table.c.question_id], set_=updates))
+
+
+def rebuild_stats(db, question_ids: Optional[list[int]] = None):
+    """Recomputes the stats from the answers table, for all questions or only the given ones."""
+    table = PersonQuestionStat.__table__
+    result_type = table.c.last_state.type
+
+    clear = delete(table)
+    answers_filter = QuestionAnswer.state != AnswerState.NOT_ANSWERED
+    if question_ids is not None:
+        clear = clear.where(table.c.question_id.in_(question_ids))
+        answers_filter = and_(answers_filter, QuestionAnswer.question_id.in_(question_ids))
+    db.execute(clear)
+
+    result = case((QuestionAnswer.state.in_((AnswerState.TRANSFERRED, AnswerState.IGNORED)),
+                   literal(AnswerResult.IGNORED, result_type)),
+                  (QuestionAnswer.person_answer == Question.answer, literal(AnswerResult.CORRECT, result_type)),
+                  else_=literal(AnswerResult.INCORRECT, result_type))
+    ranked = (select(QuestionAnswer.person_id, QuestionAnswer.question_id, QuestionAnswer.ask_time,
+                     result.label("result"),
+                     func.row_number().over(partition_by=(QuestionAnswer.person_id, QuestionAnswer.question_id),
+                                            order_by=(QuestionAnswer.ask_time.desc(),
+                                                      QuestionAnswer.id.desc())).label("rank")).
+              join(QuestionAnswer.question).
+              where(answers_filter)).subquery()
+
+    def count(value: AnswerResult):
+        return func.sum(case((ranked.c.result == literal(value, result_type), 1), else_=0))
+
+    db.execute(insert(table).from_select(
+        ["person_id", "question_id", "correct_count", "incorrect_count", "ignored_count",
+         "first_ask", "last_ask", "last_state"],
+        select(ranked.c.person_id, ranked.c.question_id,
+               count(AnswerResult.CORRECT), count(AnswerResult.INCORRECT), count(AnswerResult.IGNORED),
+               func.min(ranked.c.ask_time), func.max(ranked.c.ask_time),
+               func.max(case((ranked.c.rank == 1, ranked.c.result)))).
+        group_by(ranked.c.person_id, ranked.c.question_id)))
+
@@ -1,29 +1,63 @@
 import datetime
-import time
-from threading import Thread
+import heapq
+import itertools
+import math
+import os
+import pickle
+import zlib
+from threading import Thread, Condition
+from typing import Optional, Callable
 
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload
 
 from models import db_session
-from models.db_session import create_session
-from models.questions import AnswerState
+from models.questions import QuestionAnswer, AnswerState
 from models.users import Person
-from tools import Settings, WeekDays
+from tools import Settings, WeekDays, EventBus
+
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
 
 
 class Schedule(Thread):
-    def __init__(self, callback):
+    def __init__(self, callback, state_file=None, planned_callback=None, clock=datetime.datetime.now):
         super().__init__(daemon=True)
         self._callback = callback
+        self._planned_callback = planned_callback
+        self._state_file = state_file
+        self._clock = clock
 
         self._every = None
         self._order = None  # 1 if time period is calculated first and 0 in other case
         self._week_days = None
         self._from_time = None
         self._to_time = None
+        self._dispatch_mode = "burst"  # "burst", "even" or "jitter"
+        self._dispatch_window = None
+
+        self._timers = []  # heap of (fire time, sequence number, action)
+        self._cancelled = set()
+        self._sequence = itertools.count()
+        self._session_timer = None
+        self._wakeup = Condition()
+
+        # Session starts of the last dispatch window not made yet by person id, saved with previous_call,
+        # so a restart inside the window still asks everyone of that period
+        self._pending_dispatch: dict[int, datetime.datetime] = {}
+        self.previous_call = self._load_state()
+        self._resume_dispatch()
+
+        # Planned answers with ask_time up to the watermark are delivered, only the closest later one has a timer.
+        # Overdue answers left from a previous run are picked up by the regular sessions.
+        self._planned_watermark = clock()
+        self._planned_timer = None
+        self._planned_time = None
+
         Settings().add_update_handler(self.from_settings)
 
-        self.previous_call = None
+        if planned_callback is not None:
+            EventBus().subscribe("question_planned", self.plan)
+            self._plan_delivery()
 
     def from_settings(self):
         self._every = Settings()['time_period']
@@ -31,28 +65,226 @@ class Schedule(Thread):
         self._week_days = Settings()['week_days']
         self._from_time = Settings()['from_time']
         self._to_time = Settings()['to_time']
+        self._dispatch_mode = Settings()['dispatch_mode']
+        self._dispatch_window = Settings()['dispatch_window']
 
+        self._plan_session()
         return self
 
+    def add_timer(self, fire_time: datetime.datetime, action: Callable[[datetime.datetime], None]) -> int:
+        """Runs action(fire_time) on the schedule thread at fire_time, returns an id for cancel_timer."""
+        with self._wakeup:
+            timer_id = next(self._sequence)
+            heapq.heappush(self._timers, (fire_time, timer_id, action))
+            self._wakeup.notify()
+            return timer_id
+
+    def cancel_timer(self, timer_id: int):
+        with self._wakeup:
+            self._cancelled.add(timer_id)
+            self._wakeup.notify()
+
+    def plan(self, answer_id: int, ask_time: datetime.datetime, **_):
+        """Makes sure a newly planned answer is delivered at its ask_time."""
+        if self._planned_callback is None:
+            return
+
+        with self._wakeup:
+            if ask_time <= self._planned_watermark:
+                self.add_timer(self._clock(), lambda _: self._deliver(QuestionAnswer.id == answer_id))
+            elif self._planned_time is None or ask_time < self._planned_time:
+                self._set_delivery_timer(ask_time)
+
+    def next_call(self, now: datetime.datetime) -> Optional[datetime.datetime]:
+        """Exact time of the next session. Note that the order matters: with order 1 the time period is
+        counted on the week days that are skipped too, with order 0 the session waits for the next allowed day."""
+        if self._every is None or (self._week_days is not None and not self._week_days):
+            return None
+        if self._from_time is not None and self._from_time > self._to_time:
+            return None
+
+        candidate = now if self.previous_call is None else max(self.previous_call + self._every, now)
+        for _ in range(100_000):
+            candidate = self._window_start(candidate)
+            if self._week_days is None or WeekDays(candidate.weekday()) in self._week_days:
+                return candidate
+
+            if self._order == 1:
+                candidate += self._every
+            else:
+                candidate = datetime.datetime.combine(candidate.date() + datetime.timedelta(days=1),
+                                                      datetime.time(0))
+
+        return None
+
     def run(self) -> None:
-        """The run function of a schedule thread. Note that the order in which you call methods matters.
-         on().every() and every().on() play different roles. They in somewhat way mask each-other."""
+        """The run function of a schedule thread. Sleeps until the closest timer, settings updates and new
+        timers wake it up earlier."""
         while True:
-            now = datetime.datetime.now()
+            for fire_time, action in self._pop_due():
+                action(fire_time)
+
+            with self._wakeup:
+                self._drop_cancelled()
+                if self._timers and self._timers[0][0] <= self._clock():
+                    continue
+                timeout = (self._timers[0][0] - self._clock()).total_seconds() if self._timers else None
+                self._wakeup.wait(timeout)
+
+    def run_pending(self):
+        """Runs due timers on the calling thread."""
+        for fire_time, action in self._pop_due():
+            action(fire_time)
+
+    def task(self, fire_time: Optional[datetime.datetime] = None):
+        with db_session.create_session() as db:
+            persons = db.scalars(select(Person).where(Person.is_paused.is_(False))).all()
+
+        if self._dispatch_mode == "burst":
+            self._callback(persons)
+            return
+
+        fire_time = fire_time or self._clock()
+        offsets = self.dispatch_offsets([p.id for p in persons], fire_time)
+        self._pending_dispatch = {person_id: fire_time + offset for person_id, offset in offsets.items()}
+        self._save_state()
+        self._resume_dispatch()
+
+    def dispatch_offsets(self, person_ids: list[int], fire_time: datetime.datetime) -> dict[int, datetime.timedelta]:
+        """Offsets of the session starts from the fire time, whole seconds inside the dispatch window
+        that ends no later than to_time. Both modes depend only on the person's own id, so pausing or
+        adding someone doesn't move the others. "even" places the ids at the golden ratio sequence,
+        which spreads consecutive ids evenly over the window, "jitter" takes a pseudo-random point."""
+        window = self._dispatch_window or datetime.timedelta()
+        if self._to_time is not None:
+            window = min(window, datetime.datetime.combine(fire_time.date(), self._to_time) - fire_time)
+        seconds = max(int(window.total_seconds()), 0)
+
+        offsets = {}
+        for person_id in person_ids:
+            if self._dispatch_mode == "even":
+                offset = int(person_id * GOLDEN_RATIO % 1 * (seconds + 1))
+            else:
+                offset = zlib.crc32(str(person_id).encode()) % (seconds + 1)
+            offsets[person_id] = datetime.timedelta(seconds=offset)
 
-            question_for_person = []
-            if self._from_time is None or self._from_time <= now.time() <= self._to_time:
-                if self.previous_call is None or (now >= self.previous_call + self._every):
-                    if self._order == 1:
-                        self.previous_call = now
-                    if self._week_days is None or (WeekDays(now.weekday()) in self._week_days):
-                        self.task()
-                        self.previous_call = now
+        return offsets
 
-            time.sleep(1)
+    def _resume_dispatch(self):
+        """Sets the timers of the pending session starts, the ones already due start right away."""
+        slots = {}
+        for person_id, start_time in self._pending_dispatch.items():
+            slots.setdefault(start_time, []).append(person_id)
+
+        for start_time, person_ids in sorted(slots.items()):
+            self.add_timer(start_time, lambda fire_time, ids=person_ids: self._dispatch(ids, fire_time))
+
+    def _dispatch(self, person_ids: list[int], start_time: datetime.datetime):
+        # the timers of a window replaced by the next one are left as they are, they find nobody to start
+        person_ids = [person_id for person_id in person_ids if self._pending_dispatch.get(person_id) == start_time]
+        if not person_ids:
+            return
+        for person_id in person_ids:
+            del self._pending_dispatch[person_id]
+        self._save_state()
 
-    def task(self):
         with db_session.create_session() as db:
-            persons = db.scalars(select(Person).where(Person.is_paused.is_(False)))
-            for person in persons:
-                self._callback(person)
+            persons = db.scalars(select(Person).where(Person.id.in_(person_ids),
+                                                      Person.is_paused.is_(False))).all()
+
+        if persons:
+            self._callback(persons)
+
+    def _session(self, fire_time: datetime.datetime):
+        self.previous_call = fire_time
+        self._save_state()
+        self._session_timer = None
+
+        self.task(fire_time)
+        self._plan_session()
+
+    def _deliver_planned(self, fire_time: datetime.datetime):
+        with self._wakeup:
+            watermark, self._planned_watermark = self._planned_watermark, fire_time
+            self._planned_timer = self._planned_time = None
+
+        self._deliver(QuestionAnswer.ask_time > watermark, QuestionAnswer.ask_time <= fire_time)
+        self._plan_delivery()
+
+    def _deliver(self, *conditions):
+        with db_session.create_session() as db:
+            answers = db.scalars(select(QuestionAnswer).
+                                 join(QuestionAnswer.person).
+                                 options(joinedload(QuestionAnswer.person)).
+                                 where(QuestionAnswer.state == AnswerState.NOT_ANSWERED,
+                                       Person.is_paused.is_(False),
+                                       *conditions).
+                                 order_by(QuestionAnswer.ask_time)).all()
+
+        if answers:
+            self._planned_callback(answers)
+
+    def _plan_delivery(self):
+        with db_session.create_session() as db:
+            with self._wakeup:
+                next_time = db.scalar(select(func.min(QuestionAnswer.ask_time)).
+                                      where(QuestionAnswer.state == AnswerState.NOT_ANSWERED,
+                                            QuestionAnswer.ask_time > self._planned_watermark))
+                if next_time is not None and (self._planned_time is None or next_time < self._planned_time):
+                    self._set_delivery_timer(next_time)
+
+    def _set_delivery_timer(self, fire_time: datetime.datetime):
+        if self._planned_timer is not None:
+            self.cancel_timer(self._planned_timer)
+        self._planned_time = fire_time
+        self._planned_timer = self.add_timer(fire_time, self._deliver_planned)
+
+    def _plan_session(self):
+        with self._wakeup:
+            if self._session_timer is not None:
+                self._cancelled.add(self._session_timer)
+                self._session_timer = None
+
+            fire_time = self.next_call(self._clock())
+            if fire_time is not None:
+                self._session_timer = self.add_timer(fire_time, self._session)
+
+            self._wakeup.notify()
+
+    def _pop_due(self) -> list[tuple[datetime.datetime, Callable]]:
+        due = []
+        with self._wakeup:
+            now = self._clock()
+            while self._timers and self._timers[0][0] <= now:
+                fire_time, timer_id, action = heapq.heappop(self._timers)
+                if timer_id in self._cancelled:
+                    self._cancelled.discard(timer_id)
+                else:
+                    due.append((fire_time, action))
+        return due
+
+    def _drop_cancelled(self):
+        while self._timers and self._timers[0][1] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._timers)[1])
+
+    def _window_start(self, moment: datetime.datetime) -> datetime.datetime:
+        """The first moment not earlier than the given one that lies inside the from-to window."""
+        if self._from_time is None or self._from_time <= moment.time() <= self._to_time:
+            return moment
+        if moment.time() < self._from_time:
+            return datetime.datetime.combine(moment.date(), self._from_time)
+        return datetime.datetime.combine(moment.date() + datetime.timedelta(days=1), self._from_time)
+
+    def _load_state(self) -> Optional[datetime.datetime]:
+        if self._state_file is None or not os.path.exists(self._state_file):
+            return None
+        with open(self._state_file, "rb") as file:
+            state = pickle.load(file)
+        self._pending_dispatch = state.get("pending_dispatch", {})
+        return state.get("previous_call")
+
+    def _save_state(self):
+        if self._state_file is None:
+            return
+        with open(self._state_file, "wb") as file:
+            pickle.dump({"previous_call": self.previous_call, "pending_dispatch": self._pending_dispatch}, file)
@@ -0,0 +1,96 @@
+import datetime
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from models import db_session
+from models.db_session import SqlAlchemyBase
+from models.questions import QuestionAnswer, AnswerState
+from models.users import Person
+from models import questions, stats  # noqa: F401, registers the tables
+
+from testing.generators import fake_db
+
+
+# python -m testing.db_benchmark [seconds] [readers]
+# Runs concurrent readers and one writer against every engine profile and prints the throughput.
+
+
+def _prepare(db_file):
+    engine = db_session.create_engine(db_file)
+    SqlAlchemyBase.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        fake_db(db, [4, 50, 500, 0])
+        person_ids = db.scalars(select(Person.id)).all()
+        question_ids = db.scalars(select(questions.Question.id)).all()
+        now = datetime.datetime.now()
+        for _ in range(20_000):
+            db.add(QuestionAnswer(person_id=random.choice(person_ids), question_id=random.choice(question_ids),
+                                  ask_time=now, answer_time=now, person_answer=random.randint(1, 4),
+                                  state=AnswerState.ANSWERED))
+        db.commit()
+    engine.dispose()
+    return person_ids, question_ids
+
+
+def run(db_file, profile, person_ids, question_ids, seconds=5, readers=4):
+    factory = sessionmaker(bind=db_session.create_engine(db_file, profile))
+    counters = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def count(name):
+        with lock:
+            counters[name] += 1
+
+    def reader():
+        while time.monotonic() < stop:
+            try:
+                with factory() as db:
+                    db.scalar(select(func.count(QuestionAnswer.id)).
+                              where(QuestionAnswer.person_id == random.choice(person_ids)))
+                count("reads")
+            except OperationalError:
+                count("errors")
+
+    def writer():
+        while time.monotonic() < stop:
+            try:
+                with factory() as db:
+                    db.add(QuestionAnswer(person_id=random.choice(person_ids),
+                                          question_id=random.choice(question_ids),
+                                          ask_time=datetime.datetime.now(),
+                                          state=AnswerState.TRANSFERRED))
+                    db.commit()
+                count("writes")
+            except OperationalError:
+                count("errors")
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    factory.kw["bind"].dispose()
+    return {name: value / seconds if name != "errors" else value for name, value in counters.items()}
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    for profile in db_session.ENGINE_PROFILES:
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, "benchmark.db")
+            ids = _prepare(db_file)
+            result = run(db_file, profile, *ids, seconds=seconds, readers=readers)
+            print(f"{profile}: {result['reads']:.0f} reads/s, {result['writes']:.0f} writes/s, "
+                  f"{result['errors']} errors")
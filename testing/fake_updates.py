@@ -0,0 +1,62 @@
+import itertools
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import select
+
+from models import db_session
+from models.questions import QuestionAnswer, AnswerState
+from models.users import Person
+
+
+# python -m testing.fake_updates [webhook url] [database] [connections]
+# Answers every transferred question of the database at once, like people do after a session burst,
+# by posting fake callback updates to a bot started with TG_MODE=webhook.
+
+_update_ids = itertools.count(1)
+
+
+def fake_message(chat_id: int, text: str, message_id=1) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Fake"}
+    return {"update_id": next(_update_ids),
+            "message": {"message_id": message_id, "from": user, "chat": {"id": chat_id, "type": "private"},
+                        "date": int(time.time()), "text": text}}
+
+
+def fake_callback(chat_id: int, data: str, message_id=1) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Fake"}
+    message = fake_message(chat_id, "", message_id)["message"]
+    return {"update_id": next(_update_ids),
+            "callback_query": {"id": str(next(_update_ids)), "from": user, "message": message,
+                               "chat_instance": str(chat_id), "data": data}}
+
+
+def feed(url: str, updates: list[dict], secret=None, connections=16) -> float:
+    """Posts the updates concurrently, returns the seconds it took."""
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    started = time.perf_counter()
+    with requests.Session() as http, ThreadPoolExecutor(connections) as pool:
+        for response in pool.map(lambda update: http.post(url, data=json.dumps(update), headers=headers), updates):
+            response.raise_for_status()
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8080/"
+    db_session.global_init(sys.argv[2] if len(sys.argv) > 2 else "data/database.db")
+    connections = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    with db_session.create_session() as db:
+        answers = db.execute(select(QuestionAnswer.id, Person.tg_id).
+                             join(QuestionAnswer.person).
+                             where(QuestionAnswer.state == AnswerState.TRANSFERRED)).all()
+
+    updates = [fake_callback(tg_id, f"answer_{answer_id}_{random.randint(0, 4)}") for answer_id, tg_id in answers]
+    print(f"{len(updates)} updates posted in {feed(url, updates, connections=connections):.2f}s")
@@ -0,0 +1,67 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import sessionmaker
+
+from models import db_session
+from models.db_session import SqlAlchemyBase
+from models.questions import Question
+from models.search import create_search_index, search_questions
+from models import questions, stats  # noqa: F401, registers the tables
+
+from testing.generators import fake_db
+
+
+# python -m testing.search_benchmark [questions] [searches]
+# Compares the ILIKE search of /questions_ajax with the FTS5 index on a generated question bank.
+
+
+def ilike_search(db, search):
+    condition = or_(Question.text.ilike(f"%{search}%"),
+                    Question.subject.ilike(f"%{search}%"),
+                    Question.options.ilike(f"%{search}%"),
+                    Question.level.ilike(f"%{search}%"),
+                    Question.article_url.ilike(f"%{search}%"))
+    db.scalar(select(func.count(Question.id)).where(condition))
+    db.scalars(select(Question.id).where(condition).order_by(Question.id).limit(10)).all()
+
+
+def fts_search(db, search):
+    matches = search_questions(search)
+    db.scalar(select(func.count(matches.c.rowid)))
+    db.scalars(select(Question.id).join(matches, matches.c.rowid == Question.id).
+               order_by(matches.c.rank).limit(10)).all()
+
+
+def measure(db, search, terms):
+    started = time.perf_counter()
+    for term in terms:
+        search(db, term)
+    return (time.perf_counter() - started) / len(terms) * 1000
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    searches = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = db_session.create_engine(os.path.join(directory, "benchmark.db"), "tuned")
+        SqlAlchemyBase.metadata.create_all(engine)
+        create_search_index(engine)
+
+        with sessionmaker(bind=engine)() as db:
+            started = time.perf_counter()
+            fake_db(db, [4, 10, count, 0])
+            print(f"{count} questions generated in {time.perf_counter() - started:.0f}s")
+
+            words = [word for text in db.scalars(select(Question.text).limit(1000)) for word in text.split()]
+            terms = [random.choice(words).strip(".,")[:5] for _ in range(searches)]
+
+            for name, search in (("ILIKE", ilike_search), ("FTS5", fts_search)):
+                print(f"{name}: {measure(db, search, terms):.1f} ms per search")
+
+        engine.dispose()
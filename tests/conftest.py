@@ -0,0 +1,80 @@
+import datetime
+import os
+
+import pytest
+
+os.environ.setdefault("TGTOKEN", "1:test")
+
+from models import db_session
+from models.db_session import SqlAlchemyBase
+from models.questions import Question, QuestionAnswer, AnswerState
+from models.users import Person, PersonGroup
+from tools import Settings
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database(tmp_path_factory):
+    from main import default_settings
+
+    data = tmp_path_factory.mktemp("data")
+    Settings().setup(str(data / "settings.stg"), default_settings)
+    db_session.global_init(str(data / "database.db"))
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    yield
+    with db_session.create_session() as db:
+        for table in reversed(SqlAlchemyBase.metadata.sorted_tables):
+            db.execute(table.delete())
+        db.commit()
+
+
+@pytest.fixture
+def engine():
+    with db_session.create_session() as db:
+        return db.get_bind()
+
+
+@pytest.fixture
+def client():
+    """A test client of the web panel, logged in and without CSRF checks."""
+    from web.web import app
+
+    app.config.update(LOGIN_DISABLED=True, WTF_CSRF_ENABLED=False)
+    yield app.test_client()
+    app.config.update(LOGIN_DISABLED=False, WTF_CSRF_ENABLED=True)
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """The (method, chat id) of every bot call put on the outbound queue, nothing is sent."""
+    from bot import bot
+
+    calls = []
+    monkeypatch.setattr(bot.outbound, "call", lambda method, chat_id, *args, **kwargs: calls.append((method, chat_id)))
+    return calls
+
+
+@pytest.fixture
+def people():
+    """Two groups with 10 questions each and three persons in the first group, returns the person ids."""
+    with db_session.create_session() as db:
+        groups = [PersonGroup(name=f"group {i}") for i in range(2)]
+        for i in range(20):
+            db.add(Question(text=f"question {i}", subject=f"subject {i % 3}", options='["a", "b", "c", "d"]',
+                            answer=i % 4 + 1, level=1, groups=[groups[i % 2]]))
+        persons = [Person(full_name=f"Person {i}", tg_id=1000 + i, groups=[groups[0]]) for i in range(3)]
+        db.add_all(persons)
+        db.commit()
+        return [p.id for p in persons]
+
+
+def add_answer(person_id: int, question_id: int, ask_time: datetime.datetime,
+               state=AnswerState.NOT_ANSWERED, **values) -> int:
+    with db_session.create_session() as db:
+        answer = QuestionAnswer(person_id=person_id, question_id=question_id, ask_time=ask_time, state=state,
+                                **values)
+        db.add(answer)
+        db.commit()
+        return answer.id
@@ -0,0 +1,24 @@
+import threading
+import time
+
+import web.web
+
+
+def test_dashboard_task_starts_once_for_concurrent_dashboards(monkeypatch):
+    started = []
+
+    def start_background_task(target):
+        time.sleep(0.01)  # widens the window between the check and the start
+        started.append(target)
+        return object()
+
+    monkeypatch.setattr(web.web, "_dashboard_task", None)
+    monkeypatch.setattr(web.web.socketio, "start_background_task", start_background_task)
+
+    threads = [threading.Thread(target=web.web.start_dashboard_task) for _ in range(8)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    assert started == [web.web.push_answer_events]
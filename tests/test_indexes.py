@@ -0,0 +1,93 @@
+import datetime
+
+import pytest
+from sqlalchemy import event, select, func
+
+from bot.reaper import SessionReaper
+from models import db_session
+from models.questions import QuestionAnswer, AnswerState
+from schedule import Schedule
+from web.web import answers_timeline
+
+NOW = datetime.datetime(2024, 3, 1, 12)
+
+
+def query_plans(engine, run) -> list[str]:
+    """Runs the callable and returns the EXPLAIN QUERY PLAN of every statement on the answers table it made."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and " answers" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    assert statements
+    with engine.connect() as conn:
+        return [" | ".join(row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters))
+                for statement, parameters in statements]
+
+
+def assert_searched(plans: list[str], index: str):
+    for plan in plans:
+        assert f"INDEX {index} (" in plan, plan
+
+
+def test_planned_answers_use_state_ask_time(engine, people):
+    schedule = Schedule(lambda persons: None, planned_callback=lambda answers: None, clock=lambda: NOW)
+
+    plans = query_plans(engine, schedule._plan_delivery)
+    plans += query_plans(engine, lambda: schedule._deliver(QuestionAnswer.ask_time <= NOW))
+    assert_searched(plans, "ix_answers_state_ask_time")
+
+
+def test_reaper_uses_state_ask_time(engine, people):
+    reaper = SessionReaper(lambda person_ids: None, lambda: datetime.timedelta(hours=1), clock=lambda: NOW)
+
+    assert_searched(query_plans(engine, reaper.reap), "ix_answers_state_ask_time")
+
+
+def test_person_timeline_searches_by_person(engine, people):
+    def run():
+        with db_session.create_session() as db:
+            answers_timeline(db, people[0], NOW)
+
+    # either of the indexes starting with person_id will do
+    for plan in query_plans(engine, run):
+        assert "SEARCH answers USING INDEX ix_answers_person_" in plan and "(person_id=?" in plan, plan
+
+
+def test_question_history_uses_person_question(engine, people):
+    # the answers of a person to a question, as the question info of the statistic page loads them
+    def run():
+        with db_session.create_session() as db:
+            db.scalars(select(QuestionAnswer).
+                       where(QuestionAnswer.person_id == people[0], QuestionAnswer.question_id == 1).
+                       order_by(QuestionAnswer.ask_time)).all()
+
+    assert_searched(query_plans(engine, run), "ix_answers_person_question")
+
+
+@pytest.mark.parametrize("state", [AnswerState.NOT_ANSWERED, AnswerState.TRANSFERRED])
+def test_person_state_uses_person_state_ask_time(engine, people, state):
+    def run():
+        with db_session.create_session() as db:
+            db.scalar(select(func.count(QuestionAnswer.id)).
+                      where(QuestionAnswer.person_id == people[0], QuestionAnswer.state == state,
+                            QuestionAnswer.ask_time <= NOW))
+
+    assert_searched(query_plans(engine, run), "ix_answers_person_state_ask_time")
+
+
+def test_answered_in_period_uses_person_answer_time(engine, people):
+    def run():
+        with db_session.create_session() as db:
+            db.scalar(select(func.count(QuestionAnswer.id)).
+                      where(QuestionAnswer.person_id == people[0],
+                            QuestionAnswer.answer_time.between(NOW - datetime.timedelta(days=1), NOW)))
+
+    assert_searched(query_plans(engine, run), "ix_answers_person_answer_time")
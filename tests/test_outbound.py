@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+from requests import ConnectionError
+from telebot.apihelper import ApiTelegramException
+
+from bot.outbound import OutboundQueue, TokenBucket
+
+
+class FakeTime:
+    """A monotonic clock that only moves when somebody sleeps, the sleeps are recorded."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+class StubBot:
+    """Records the calls with the fake time they were made at, fails them as told by failures[chat_id]."""
+
+    def __init__(self, time: FakeTime):
+        self.time = time
+        self.calls = []
+        self.failures = {}
+
+    def send_message(self, chat_id, text, **kwargs):
+        failures = self.failures.get(chat_id)
+        if failures:
+            raise failures.pop(0)
+        self.calls.append((self.time.now, chat_id, text))
+
+
+def too_many_requests(retry_after=None) -> ApiTelegramException:
+    result_json = {"ok": False, "error_code": 429, "description": "Too Many Requests"}
+    if retry_after is not None:
+        result_json["parameters"] = {"retry_after": retry_after}
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+@pytest.fixture
+def time():
+    return FakeTime()
+
+
+@pytest.fixture
+def stub_bot(time):
+    return StubBot(time)
+
+
+@pytest.fixture
+def send(stub_bot, time):
+    """Queues (chat id, text) messages on a started queue and waits until they are handled."""
+    queues = []
+
+    def send(messages, **options):
+        outbound = OutboundQueue(stub_bot, clock=time.clock, sleep=time.sleep, **options).start()
+        queues.append(outbound)
+        for chat_id, text in messages:
+            outbound.send_message(chat_id, text)
+        outbound.join()
+
+    yield send
+    for outbound in queues:
+        outbound.stop()
+
+
+def test_token_bucket_waits_once_the_burst_is_spent(time):
+    bucket = TokenBucket(rate=2, capacity=3, clock=time.clock)
+
+    assert [bucket.reserve() for _ in range(5)] == [0, 0, 0, 0.5, 1.0]
+    time.sleep(1.0)
+    assert bucket.reserve() == 0.5  # the 2 tokens of that second paid back the 2 reserved ahead
+
+
+def test_chat_messages_are_spaced_after_the_burst(send, stub_bot):
+    send([(1, i) for i in range(6)], workers=1, chat_rate=1, chat_burst=4)
+
+    assert [text for at, chat_id, text in stub_bot.calls] == list(range(6))
+    assert [at for at, chat_id, text in stub_bot.calls] == [0, 0, 0, 0, 1, 2]
+
+
+def test_global_rate_limits_all_chats(send, stub_bot):
+    send([(chat_id, "hi") for chat_id in range(40)], workers=1, global_rate=30)
+
+    times = [at for at, chat_id, text in stub_bot.calls]
+    assert len(times) == 40
+    assert times[29] == 0 and times[30] == pytest.approx(1 / 30)
+    assert times[-1] == pytest.approx(10 / 30)
+
+
+def test_retry_after_of_429_is_respected(send, stub_bot, time):
+    stub_bot.failures[1] = [too_many_requests(retry_after=7)]
+    send([(1, "hi")], workers=1)
+
+    assert 7 in time.sleeps
+    assert [(at, text) for at, chat_id, text in stub_bot.calls] == [(7, "hi")]
+
+
+def test_network_errors_back_off_exponentially(send, stub_bot, time):
+    stub_bot.failures[1] = [ConnectionError(), ConnectionError(), too_many_requests()]
+    send([(1, "hi")], workers=1)
+
+    assert [s for s in time.sleeps if s] == [1, 2, 4]
+    assert [text for at, chat_id, text in stub_bot.calls] == ["hi"]
+
+
+def test_message_is_dropped_after_max_retries(send, stub_bot):
+    stub_bot.failures[1] = [ConnectionError() for _ in range(3)]
+    send([(1, "lost"), (1, "next")], workers=1, max_retries=2)
+
+    assert [text for at, chat_id, text in stub_bot.calls] == ["next"]
+
+
+def test_other_api_errors_are_not_retried(send, stub_bot):
+    stub_bot.failures[1] = [ApiTelegramException("sendMessage", None, {"error_code": 403, "description": "blocked"})]
+    send([(1, "blocked"), (2, "hi")], workers=1)
+
+    assert [text for at, chat_id, text in stub_bot.calls] == ["hi"]
+
+
+def test_each_chat_keeps_its_order_across_workers(send, stub_bot):
+    # retries of one chat hold back only the messages of that chat's worker
+    stub_bot.failures[3] = [too_many_requests(retry_after=1) for _ in range(3)]
+    send([(chat_id, i) for i in range(20) for chat_id in range(8)], workers=4, chat_burst=100, global_rate=1000)
+
+    for chat_id in range(8):
+        assert [text for at, chat, text in stub_bot.calls if chat == chat_id] == list(range(20))
@@ -0,0 +1,60 @@
+import io
+import json
+
+from sqlalchemy import select
+
+from models import db_session
+from models.questions import Question
+from models.users import PersonGroup
+
+
+def upload(client, filename: str, content: bytes, **fields):
+    data = {"uploadquestionsform-file": (io.BytesIO(content), filename),
+            "uploadquestionsform-subject": "imported"}
+    data.update({f"uploadquestionsform-{key}": value for key, value in fields.items()})
+    return client.post("/questions/upload", data=data, content_type="multipart/form-data")
+
+
+def test_upload_jsonl(client):
+    with db_session.create_session() as db:
+        group = PersonGroup(name="group")
+        db.add(group)
+        db.commit()
+        group_id = group.id
+
+    records = [{"question": f"Вопрос {i}", "options": ["a", "b"], "answer": "b", "difficulty": i} for i in range(3)]
+    content = "\ufeff" + "\n".join(json.dumps(r, ensure_ascii=False) for r in records) + "\n\n"
+
+    response = upload(client, "questions.jsonl", content.encode("utf-8"), groups=str(group_id))
+    assert response.status_code == 200
+    assert response.json == {"imported": 3, "records": 3, "errors": []}
+
+    with db_session.create_session() as db:
+        questions = db.scalars(select(Question).order_by(Question.id)).all()
+        assert [q.text for q in questions] == ["Вопрос 0", "Вопрос 1", "Вопрос 2"]
+        assert [q.answer for q in questions] == [2, 2, 2]
+        assert all(q.subject == "imported" and [g.id for g in q.groups] == [group_id] for q in questions)
+
+
+def test_upload_csv_with_multiline_options(client):
+    content = 'question,options,answer,difficulty\r\nFirst,"a\r\nb\r\nc",c,1\r\nSecond,"x\r\ny",x,2\r\n'
+
+    response = upload(client, "questions.csv", content.encode("utf-8"))
+    assert response.status_code == 200
+    assert response.json["imported"] == 2
+
+    with db_session.create_session() as db:
+        options = db.scalars(select(Question.options).order_by(Question.id)).all()
+        assert [json.loads(o) for o in options] == [["a", "b", "c"], ["x", "y"]]
+
+
+def test_upload_reports_invalid_lines_and_imports_nothing(client):
+    content = b'{"question": "q", "options": ["a"], "answer": "a", "difficulty": 1}\n{broken\n'
+
+    response = upload(client, "questions.jsonl", content)
+    assert response.status_code == 400
+    assert response.json["records"] == 2
+    assert [e["line"] for e in response.json["errors"]] == [2]
+
+    with db_session.create_session() as db:
+        assert db.scalars(select(Question)).all() == []
@@ -0,0 +1,51 @@
+import datetime
+
+import pytest
+from sqlalchemy import select
+
+from bot import bot
+from bot.reaper import SessionReaper
+from conftest import add_answer
+from models import db_session
+from models.questions import QuestionAnswer, AnswerState
+from models.users import Person
+from tools import Settings
+
+
+@pytest.fixture
+def reaper(monkeypatch):
+    monkeypatch.setitem(Settings(), "max_time", datetime.timedelta(hours=1))
+    return SessionReaper(bot.close_expired, lambda: Settings()["max_time"])
+
+
+def answer_state(answer_id: int) -> AnswerState:
+    with db_session.create_session() as db:
+        return db.get(QuestionAnswer, answer_id).state
+
+
+def test_unanswered_question_is_ignored_after_max_time(people, reaper, sent):
+    answer_id = add_answer(people[0], 1, datetime.datetime.now() - datetime.timedelta(hours=2),
+                           AnswerState.TRANSFERRED)
+
+    assert reaper.reap() == [people[0]]
+    assert answer_state(answer_id) == AnswerState.IGNORED
+    assert reaper.reap() == []
+
+
+def test_late_planned_answer_is_not_reaped_when_sent(people, reaper, sent):
+    answer_id = add_answer(people[0], 1, datetime.datetime.now() - datetime.timedelta(hours=3))
+    with db_session.create_session() as db:
+        person = db.get(Person, people[0])
+        answer = db.get(QuestionAnswer, answer_id)
+        bot.create_session(person, [answer])
+
+    assert sent == [("send_message", person.tg_id)]
+    assert answer_state(answer_id) == AnswerState.TRANSFERRED
+
+    # max_time is counted from sending, not from the planned time
+    assert reaper.reap() == []
+    assert answer_state(answer_id) == AnswerState.TRANSFERRED
+
+    with db_session.create_session() as db:
+        ask_time = db.scalar(select(QuestionAnswer.ask_time).where(QuestionAnswer.id == answer_id))
+    assert datetime.datetime.now() - ask_time < datetime.timedelta(minutes=1)
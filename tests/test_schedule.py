@@ -0,0 +1,154 @@
+import datetime
+
+import pytest
+
+from conftest import add_answer
+from schedule import Schedule
+from tools import Settings
+
+START = datetime.datetime(2024, 3, 4, 10)  # a Monday
+
+
+class FakeClock:
+    def __init__(self, now: datetime.datetime):
+        self.now = now
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(START)
+
+
+@pytest.fixture
+def settings():
+    saved = dict(Settings())
+    Settings().update({"time_period": datetime.timedelta(days=1),
+                       "from_time": datetime.time(0),
+                       "to_time": datetime.time(23, 59),
+                       "dispatch_mode": "burst",
+                       "dispatch_window": datetime.timedelta(hours=1)})
+    yield Settings()
+    Settings().clear()
+    Settings().update(saved)
+
+
+def run_until(schedule: Schedule, clock: FakeClock, moment: datetime.datetime):
+    """Runs the timers due up to the moment, the ones added by other timers included."""
+    clock.now = moment
+    for _ in range(10):
+        schedule.run_pending()
+
+
+def test_even_offsets_do_not_depend_on_the_others(people, settings, clock):
+    settings["dispatch_mode"] = "even"
+    schedule = Schedule(lambda persons: None, clock=clock).from_settings()
+
+    offsets = schedule.dispatch_offsets(people, START)
+    assert len(set(offsets.values())) == len(people)
+    assert all(datetime.timedelta() <= offset <= datetime.timedelta(hours=1) for offset in offsets.values())
+
+    # pausing one person or adding another keeps everybody else's start
+    assert schedule.dispatch_offsets(people[1:], START) == {p: offsets[p] for p in people[1:]}
+    assert schedule.dispatch_offsets(people + [people[-1] + 1], START).items() >= offsets.items()
+
+    # consecutive ids are spread across the whole window
+    spread = sorted(schedule.dispatch_offsets(list(range(1, 61)), START).values())
+    assert max(b - a for a, b in zip(spread, spread[1:])) < datetime.timedelta(minutes=3)
+
+
+def test_restart_resumes_pending_dispatch(people, settings, clock, tmp_path):
+    settings["dispatch_mode"] = "even"
+    state_file = str(tmp_path / "schedule.state")
+    started = []
+
+    def callback(persons):
+        started.extend(p.id for p in persons)
+
+    schedule = Schedule(callback, state_file, clock=clock).from_settings()
+    offsets = schedule.dispatch_offsets(people, START)
+    order = sorted(people, key=offsets.get)
+    run_until(schedule, clock, START + offsets[order[0]])
+    assert started == order[:1]
+
+    # restarted in the middle of the dispatch window
+    clock.now = START + (offsets[order[1]] + offsets[order[2]]) / 2
+    schedule = Schedule(callback, state_file, clock=clock).from_settings()
+    run_until(schedule, clock, clock.now)
+    assert started == order[:2]
+
+    run_until(schedule, clock, START + datetime.timedelta(hours=2))
+    assert started == order
+
+    # nobody is asked twice when the schedule restarts again
+    schedule = Schedule(callback, state_file, clock=clock).from_settings()
+    run_until(schedule, clock, clock.now)
+    assert started == order
+
+
+@pytest.fixture
+def delivered():
+    return []
+
+
+@pytest.fixture
+def planner(people, settings, clock, delivered):
+    """A schedule delivering planned answers, started at START without sessions."""
+    return Schedule(lambda persons: None, clock=clock,
+                    planned_callback=lambda answers: delivered.append([a.id for a in answers]))
+
+
+def plan(schedule: Schedule, person_id: int, ask_time: datetime.datetime) -> int:
+    answer_id = add_answer(person_id, 1, ask_time)
+    schedule.plan(answer_id=answer_id, ask_time=ask_time)
+    return answer_id
+
+
+def test_planned_answer_delivered_at_ask_time(planner, people, clock, delivered):
+    answer_id = plan(planner, people[0], START + datetime.timedelta(hours=1))
+
+    run_until(planner, clock, START + datetime.timedelta(minutes=59, seconds=59))
+    assert delivered == []
+
+    run_until(planner, clock, START + datetime.timedelta(hours=1))
+    assert delivered == [[answer_id]]
+
+
+def test_planned_answers_existing_on_start_are_delivered(people, settings, clock, delivered):
+    answer_id = add_answer(people[0], 1, START + datetime.timedelta(hours=1))
+    schedule = Schedule(lambda persons: None, clock=clock,
+                        planned_callback=lambda answers: delivered.append([a.id for a in answers]))
+
+    run_until(schedule, clock, START + datetime.timedelta(hours=1))
+    assert delivered == [[answer_id]]
+
+
+def test_earlier_planned_answer_replaces_timer(planner, people, clock, delivered):
+    later = plan(planner, people[0], START + datetime.timedelta(hours=2))
+    earlier = plan(planner, people[1], START + datetime.timedelta(hours=1))
+
+    run_until(planner, clock, START + datetime.timedelta(hours=1))
+    assert delivered == [[earlier]]
+
+    run_until(planner, clock, START + datetime.timedelta(hours=3))
+    assert delivered == [[earlier], [later]]
+
+
+def test_past_due_answer_delivered_right_away(planner, people, clock, delivered):
+    answer_id = plan(planner, people[0], START - datetime.timedelta(hours=3))
+
+    run_until(planner, clock, START)
+    assert delivered == [[answer_id]]
+
+
+def test_watermark_prevents_redelivery(planner, people, clock, delivered):
+    first = [plan(planner, person_id, START + datetime.timedelta(hours=1)) for person_id in people[:2]]
+    second = plan(planner, people[2], START + datetime.timedelta(hours=2))
+
+    run_until(planner, clock, START + datetime.timedelta(hours=1))
+    run_until(planner, clock, START + datetime.timedelta(hours=5))
+
+    # the first answers are still not answered, but they are not delivered again
+    assert delivered == [sorted(first), [second]]
@@ -0,0 +1,79 @@
+import datetime
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from bot import bot
+from conftest import add_answer
+from models import db_session
+from models.questions import Question, QuestionAnswer, AnswerState
+from models.users import Person
+
+
+def planned_answer(person_id: int, question_id: int) -> QuestionAnswer:
+    answer_id = add_answer(person_id, question_id, datetime.datetime.now())
+    with db_session.create_session() as db:
+        return db.scalar(select(QuestionAnswer).options(joinedload(QuestionAnswer.person)).
+                         where(QuestionAnswer.id == answer_id))
+
+
+def asked_questions(person_id: int) -> list[int]:
+    with db_session.create_session() as db:
+        return db.scalars(select(QuestionAnswer.question_id).
+                          where(QuestionAnswer.person_id == person_id,
+                                QuestionAnswer.state == AnswerState.TRANSFERRED).
+                          order_by(QuestionAnswer.ask_time, QuestionAnswer.id)).all()
+
+
+def test_planned_answers_start_a_session(people, sent):
+    answer = planned_answer(people[0], 5)
+
+    bot.deliver_planned([answer])
+
+    assert sent == [("send_message", answer.person.tg_id)]
+    assert asked_questions(people[0]) == [5]
+
+
+def test_planned_answers_join_a_running_session(people, sent):
+    with db_session.create_session() as db:
+        person = db.get(Person, people[0])
+        bot.create_session(person, db.scalars(select(Question).where(Question.id.in_([1, 2]))).all())
+    assert asked_questions(people[0]) == [1]
+
+    bot.deliver_planned([planned_answer(people[0], 5), planned_answer(people[0], 6)])
+    # the person is still answering question 1, nothing else is sent yet
+    assert len(sent) == 1
+
+    for _ in range(4):
+        bot.send_question(person.tg_id)
+    assert asked_questions(people[0]) == [1, 5, 6, 2]
+    assert bot.states.get("session", person.tg_id) is None
+
+
+def test_concurrent_sends_take_different_questions(people, sent, monkeypatch):
+    with db_session.create_session() as db:
+        person = db.get(Person, people[0])
+        bot.create_session(person, db.scalars(select(Question).where(Question.id.in_([1, 2, 3]))).all())
+
+    # both threads read the stored session before either writes it back, unless the chat lock keeps them apart
+    barrier = threading.Barrier(2, timeout=0.5)
+    get = bot.states.get
+
+    def get_together(kind, key):
+        state = get(kind, key)
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        return state
+
+    monkeypatch.setattr(bot.states, "get", get_together)
+    threads = [threading.Thread(target=bot.send_question, args=(person.tg_id,)) for _ in range(2)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    # the two sends may stamp their ask times in either order
+    assert sorted(asked_questions(people[0])) == [1, 2, 3]
@@ -0,0 +1,46 @@
+import datetime
+
+from sqlalchemy import event, select
+
+from conftest import add_answer
+from models import db_session
+from models.questions import Question, AnswerState
+
+
+def count_statements(engine, run) -> int:
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return len(statements)
+
+
+def answer_questions(person_id: int, count: int):
+    with db_session.create_session() as db:
+        question_ids = db.scalars(select(Question.id).order_by(Question.id)).all()
+
+    now = datetime.datetime.now()
+    for i in range(count):
+        add_answer(person_id, question_ids[i % len(question_ids)], now - datetime.timedelta(hours=i),
+                   AnswerState.ANSWERED, person_answer=1, answer_time=now - datetime.timedelta(hours=i))
+
+
+def test_statistic_page_statements_do_not_grow_with_history(client, engine, people):
+    answer_questions(people[0], 1)
+    answer_questions(people[1], 20)
+
+    def render(person_id):
+        response = client.get(f"/statistic/{person_id}")
+        assert response.status_code == 200
+
+    short = count_statements(engine, lambda: render(people[0]))
+    long = count_statements(engine, lambda: render(people[1]))
+
+    # person, groups, subjects, questions with stats, history with questions, timeline
+    assert short == long == 6
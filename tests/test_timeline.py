@@ -0,0 +1,65 @@
+import datetime
+import json
+
+import pytest
+
+from conftest import add_answer
+from models.questions import AnswerState
+from web.web import app, socketio
+
+
+@pytest.fixture
+def socket(client):
+    socket = socketio.test_client(app, flask_test_client=client)
+    yield socket
+    socket.disconnect()
+
+
+def request_timeline(socket, view: dict) -> dict:
+    socket.get_received()
+    socket.emit('index_connected_timeline', view)
+    return json.loads(next(m for m in socket.get_received() if m["name"] == "timeline")["args"][0])
+
+
+def answer(person_id: int, question_id: int, answer_time: datetime.datetime, person_answer: int):
+    add_answer(person_id, question_id, answer_time, AnswerState.ANSWERED,
+               person_answer=person_answer, answer_time=answer_time)
+
+
+def points(data: dict) -> list[tuple[int, int]]:
+    return sorted((point["y"], point["count"])
+                  for key in ("timeline_data_correct", "timeline_data_incorrect") for point in data[key])
+
+
+def test_reconnect_with_cursor_returns_only_newer_answers(socket, people):
+    now = datetime.datetime.now()
+    for hours in range(1, 6):
+        answer(people[0], hours, now - datetime.timedelta(hours=hours), 1)
+
+    full = request_timeline(socket, {})
+    assert not full["incremental"]
+    assert sum(count for person, count in points(full)) == 5
+
+    # a new answer moves the end of the un-zoomed view, the client sends its stored view back
+    answer(people[1], 1, datetime.datetime.now(), 2)
+    view = {"from": full["from"], "bucket": full["bucket"], "since": full["since"]}
+    update = request_timeline(socket, view)
+
+    assert update["incremental"]
+    assert update["bucket"] == full["bucket"] and update["from"] == full["from"]
+    assert points(update) == [(people[1], 1)]
+
+
+def test_cursor_is_dropped_when_the_range_outgrows_the_bucket(socket, people):
+    now = datetime.datetime.now()
+    answer(people[0], 1, now - datetime.timedelta(hours=1), 1)
+
+    full = request_timeline(socket, {})
+    answer(people[0], 2, now, 1)
+    later = {"from": full["from"], "to": (now + datetime.timedelta(hours=3)).timestamp() * 1000,
+             "bucket": full["bucket"], "since": full["since"]}
+    update = request_timeline(socket, later)
+
+    assert not update["incremental"]
+    assert update["bucket"] > full["bucket"]
+    assert sum(count for person, count in points(update)) == 2
@@ -0,0 +1,80 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from bot.webhook import UpdateDispatcher, WebhookServer
+
+
+class StubBot:
+    """Records the chat and text of the handled updates, taking a random moment for each."""
+
+    def __init__(self):
+        self.handled = []
+        self._lock = threading.Lock()
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            time.sleep(random.random() / 100)
+            with self._lock:
+                self.handled.append((update.message.chat.id, update.message.text))
+
+
+@pytest.fixture
+def stub_bot():
+    return StubBot()
+
+
+@pytest.fixture
+def server(stub_bot):
+    dispatcher = UpdateDispatcher(stub_bot, workers=4).start()
+    server = WebhookServer(("127.0.0.1", 0), dispatcher, secret="secret")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    dispatcher.stop()
+
+
+def post(server: WebhookServer, update, secret="secret") -> int:
+    body = update if isinstance(update, bytes) else json.dumps(update).encode()
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_address[1]}/", data=body, method="POST",
+                                     headers={"Content-Type": "application/json",
+                                              "X-Telegram-Bot-Api-Secret-Token": secret})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "text": text,
+                        "chat": {"id": chat_id, "type": "private"}}}
+
+
+def test_updates_of_a_chat_are_handled_in_order(server, stub_bot):
+    update_id = 0
+    for i in range(30):
+        for chat_id in range(1, 6):
+            update_id += 1
+            assert post(server, message_update(update_id, chat_id, str(i))) == 200
+    server.dispatcher.join()
+
+    assert len(stub_bot.handled) == 150
+    for chat_id in range(1, 6):
+        assert [text for chat, text in stub_bot.handled if chat == chat_id] == [str(i) for i in range(30)]
+
+
+def test_bad_requests_are_rejected(server, stub_bot):
+    assert post(server, message_update(1, 1, "hi"), secret="wrong") == 403
+    assert post(server, b"{broken") == 400
+    server.dispatcher.join()
+
+    assert stub_bot.handled == []
@@ -23,12 +23,27 @@ class Settings(dict):
             with open(filename, "wb") as file:
                 pickle.dump(dict(), file)
 
-        with open(filename, "rb") as file:
-            self.update(pickle.load(file))
+        self._load()
+        EventBus().subscribe("settings_changed", self._reload)
 
     def update_settings(self):
         with open(self.file, "wb") as file:
             pickle.dump(self.copy(), file)
+        self._mtime = os.stat(self.file).st_mtime_ns
+        for handler in self._update_handlers:
+            handler()
+        EventBus().publish("settings_changed")
+
+    def _load(self):
+        with open(self.file, "rb") as file:
+            self.update(pickle.load(file))
+        self._mtime = os.stat(self.file).st_mtime_ns
+
+    def _reload(self, **_):
+        """Picks up the settings saved by another process."""
+        if os.stat(self.file).st_mtime_ns == self._mtime:
+            return
+        self._load()
         for handler in self._update_handlers:
             handler()
 
@@ -36,6 +51,34 @@ class Settings(dict):
         self._update_handlers.append(handler)
 
 
+class EventBus:
+    """In-process publish/subscribe, handlers are called on the publishing thread.
+    Forwarders get every published event too, ipc.connect() uses them to pass events to other processes."""
+
+    def __new__(cls):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super(EventBus, cls).__new__(cls)
+            cls.instance._handlers = {}
+            cls.instance._forwarders = []
+        return cls.instance
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def add_forwarder(self, forwarder):
+        self._forwarders.append(forwarder)
+
+    def publish(self, topic, **payload):
+        self.deliver(topic, **payload)
+        for forwarder in self._forwarders:
+            forwarder(topic, **payload)
+
+    def deliver(self, topic, **payload):
+        """Calls the local handlers only, for the events that came from another process."""
+        for handler in self._handlers.get(topic, []):
+            handler(**payload)
+
+
 class WeekDays(enum.Enum):
     Monday = 0
     Tuesday = 1
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import SubmitField, HiddenField
 from wtforms.fields import StringField, DateTimeField, IntegerField, TextAreaField, SelectMultipleField
 from wtforms.validators import DataRequired, ValidationError
@@ -31,6 +32,16 @@ class ImportQuestionForm(BasePrefixedForm):
     import_btn = SubmitField("Create")
 
 
+class UploadQuestionsForm(BasePrefixedForm):
+    file = FileField("File (JSON Lines or CSV)", validators=[FileRequired(), FileAllowed(["jsonl", "json", "csv"])])
+    subject = StringField("Subject")
+    groups = SelectMultipleField("Groups")
+    article = StringField("Article")
+    sid = HiddenField()
+
+    upload = SubmitField("Upload")
+
+
 class PlanQuestionForm(BasePrefixedForm):
     question_id = IntegerField()
     person_id = IntegerField()
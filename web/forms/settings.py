@@ -1,6 +1,6 @@
 import datetime
 
-from wtforms.fields import StringField, SelectMultipleField, IntegerField, TimeField, SubmitField
+from wtforms.fields import StringField, SelectMultipleField, IntegerField, TimeField, SubmitField, SelectField
 from wtforms.validators import DataRequired, ValidationError
 from wtforms.widgets import TextInput
 
@@ -65,6 +65,10 @@ class ScheduleSettingsForm(BasePrefixedForm):
                                     coerce=int)
     from_time = TimeField("From", validators=[DataRequired()])
     to_time = TimeField("To", validators=[DataRequired()])
+    dispatch_mode = SelectField("Session dispatch", choices=[("burst", "Everyone at once"),
+                                                             ("even", "Evenly across the window"),
+                                                             ("jitter", "Randomly across the window")])
+    dispatch_window = TimeDeltaField("Dispatch window")
 
     save_schedule = SubmitField("Save")
 
@@ -0,0 +1,110 @@
+import codecs
+import csv
+import json
+from typing import Iterator, Optional, Callable
+
+from sqlalchemy import insert
+
+from models.questions import Question, QuestionGroupAssociation
+
+# Uploaded imports are JSON Lines, one {"question", "options", "answer", "difficulty"} object per line,
+# or CSV with the same columns and the options one per line inside the options cell.
+
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFailed(Exception):
+    def __init__(self, errors: list[dict], records: int):
+        super().__init__(f"{len(errors)} invalid records")
+        self.errors = errors
+        self.records = records
+
+
+def read_records(stream, file_format: str) -> Iterator[tuple[int, object]]:
+    """Yields (line number, raw record) while reading the binary stream, never loading the whole file."""
+    # decodes line by line rather than with io.TextIOWrapper, which needs readable() that
+    # SpooledTemporaryFile only has since Python 3.11
+    text = codecs.iterdecode(stream, "utf-8-sig")
+
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            record["options"] = (record.get("options") or "").splitlines()
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, e
+
+
+def parse_record(record) -> dict:
+    """Checks a raw record and turns it into a questions row, raises ValueError with the reason."""
+    if isinstance(record, json.JSONDecodeError):
+        raise ValueError(f"Invalid JSON: {record.msg}")
+    if not isinstance(record, dict):
+        raise ValueError("Record should be an object")
+
+    for key in ("question", "options", "answer", "difficulty"):
+        if record.get(key) in (None, ""):
+            raise ValueError(f"'{key}' is missing")
+
+    options = record["options"]
+    if not isinstance(options, list) or not options or not all(isinstance(o, str) for o in options):
+        raise ValueError("'options' should be a non-empty list of strings")
+    if record["answer"] not in options:
+        raise ValueError("Answer '{}' wasn't found in options".format(record["answer"]))
+
+    try:
+        level = int(record["difficulty"])
+    except (TypeError, ValueError):
+        raise ValueError("'difficulty' should be an integer")
+
+    return {"text": str(record["question"]),
+            "options": json.dumps(options, ensure_ascii=False),
+            "answer": options.index(record["answer"]) + 1,
+            "level": level}
+
+
+def import_questions(db, stream, file_format: str, subject: Optional[str], article_url: Optional[str],
+                     group_ids: list[int], progress: Optional[Callable[[str, int], None]] = None,
+                     chunk_size=1000) -> int:
+    """Validates the whole file first and inserts nothing if any record is invalid (ImportFailed has
+    the errors), then inserts the questions and their groups in chunks. Doesn't commit."""
+    progress = progress or (lambda stage, count: None)
+
+    rows, errors = [], []
+    records = 0
+    for line_number, record in read_records(stream, file_format):
+        records += 1
+        try:
+            row = parse_record(record)
+        except ValueError as e:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_number, "error": str(e)})
+            continue
+
+        row.update(subject=subject, article_url=article_url)
+        rows.append(row)
+        if records % chunk_size == 0:
+            progress("validated", records)
+
+    if errors or not rows:
+        raise ImportFailed(errors or [{"line": 0, "error": "No records found"}], records)
+    progress("validated", records)
+
+    questions = Question.__table__
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        ids = db.scalars(insert(questions).returning(questions.c.id, sort_by_parameter_order=True), chunk).all()
+        if group_ids:
+            db.execute(insert(QuestionGroupAssociation.__table__),
+                       [{"question_id": question_id, "group_id": group_id}
+                        for question_id in ids for group_id in group_ids])
+        progress("inserted", start + len(chunk))
+
+    return len(rows)
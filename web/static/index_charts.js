@@ -1,43 +1,116 @@
 let socket = io();
+// Range and bucket of the shown timeline, "since" is the cursor of the last received answer
+let timeline_view = {};
+
 socket.on('connect', function () {
-    socket.emit('index_connected_timeline');
+    socket.emit('index_connected_timeline', timeline_view);
     socket.emit('index_connected');
 });
 
-socket.on('peopleList', function (json_data) {
-    let items = document.getElementsByClassName('placeholder-glow');
-    Array.from(items).forEach(function (item) {
-        item.remove();
-    });
-
-    let list = document.getElementById('PeopleList');
-    let data = JSON.parse(json_data)
+function personItem(item) {
     let textSecondary = ""
-    if (data.person.is_paused) {
-        textSecondary += "\"text-secondary\""
+    if (item.person.is_paused) {
+        textSecondary += "text-secondary"
     }
     let badge = ""
-    if (data.answered_count !== 0) {
-        if ((data.correct_count / data.answered_count) > 0.75) {
-            badge += "<span class=\"badge bg-success rounded-pill\">" + Math.round((data.correct_count / data.answered_count) * 1000) / 10 + "%</span>"
-        } else if ((data.correct_count / data.answered_count) > 0.5) {
-            badge += "<span class=\"badge bg-primary rounded-pill\">" + Math.round((data.correct_count / data.answered_count) * 1000) / 10 + "%</span>"
-        } else if ((data.correct_count / data.answered_count) > 0) {
-            badge += "<span class=\"badge bg-warning rounded-pill\">" + Math.round((data.correct_count / data.answered_count) * 1000) / 10 + "%</span>"
+    if (item.answered_count !== 0) {
+        if ((item.correct_count / item.answered_count) > 0.75) {
+            badge += "<span class=\"badge bg-success rounded-pill\">" + Math.round((item.correct_count / item.answered_count) * 1000) / 10 + "%</span>"
+        } else if ((item.correct_count / item.answered_count) > 0.5) {
+            badge += "<span class=\"badge bg-primary rounded-pill\">" + Math.round((item.correct_count / item.answered_count) * 1000) / 10 + "%</span>"
+        } else if ((item.correct_count / item.answered_count) > 0) {
+            badge += "<span class=\"badge bg-warning rounded-pill\">" + Math.round((item.correct_count / item.answered_count) * 1000) / 10 + "%</span>"
         }
     } else {
         badge += "<span class=\"badge bg-danger rounded-pill\">0 %</span>"
     }
-    list.innerHTML += "<a href=\"/statistic/" + data.person.id + "\"" + "class=\"list-group-item d-flex justify-content-between align-items-center " +
-        textSecondary + "\">" + data.person.full_name + badge + "</a>";
+    return "<a id=\"person-" + item.person.id + "\" href=\"/statistic/" + item.person.id + "\"" +
+        " class=\"list-group-item d-flex justify-content-between align-items-center " +
+        textSecondary + "\">" + item.person.full_name + badge + "</a>";
+}
+
+socket.on('peopleList', function (json_data) {
+    let list = document.getElementById('PeopleList');
+    let data = JSON.parse(json_data)
+
+    if (data.page === 0) {
+        list.innerHTML = "";
+    }
+    list.insertAdjacentHTML("beforeend", data.people.map(personItem).join(""));
 })
 
+function bubbleRadius(point, base) {
+    return Math.min(base + 2 * Math.log2(point.count), 20);
+}
+
+function mergePoints(dataset, points, base) {
+    let known = new Map(dataset.data.map(point => [point.x + ':' + point.y, point]));
+    points.forEach(function (point) {
+        let old = known.get(point.x + ':' + point.y);
+        if (old) {
+            old.count += point.count;
+            old.r = bubbleRadius(old, base);
+        } else {
+            point.r = bubbleRadius(point, base);
+            dataset.data.push(point);
+        }
+    });
+}
+
 socket.on('timeline', function (json_data) {
     let data = JSON.parse(json_data);
-    bubble_chart.data.datasets[0].data = data.timeline_data_correct;
-    bubble_chart.data.datasets[1].data = data.timeline_data_incorrect;
+    if (!data.incremental) {
+        bubble_chart.data.datasets[0].data = [];
+        bubble_chart.data.datasets[1].data = [];
+    }
+    mergePoints(bubble_chart.data.datasets[0], data.timeline_data_correct, 5);
+    mergePoints(bubble_chart.data.datasets[1], data.timeline_data_incorrect, 3);
+    timeline_view.from = data.from;
+    timeline_view.bucket = data.bucket;
+    timeline_view.since = data.since;
+    bubble_chart.update();
+})
+
+socket.on('dashboardUpdate', function (json_data) {
+    let data = JSON.parse(json_data);
+    let list = document.getElementById('PeopleList');
+
+    data.people.forEach(function (item) {
+        let element = document.getElementById('person-' + item.person.id);
+        if (element) {
+            element.outerHTML = personItem(item);
+        } else {
+            list.insertAdjacentHTML("beforeend", personItem(item));
+        }
+    });
+
+    // Answers are put into the buckets of the shown timeline, the cursor moves so a reconnect doesn't repeat them
+    if (timeline_view.bucket === undefined) {
+        return;
+    }
+    let inView = function (point) {
+        if (point.x < timeline_view.from || (timeline_view.to !== undefined && point.x > timeline_view.to)) {
+            return false;
+        }
+        if (timeline_view.since === null || point.time > timeline_view.since) {
+            timeline_view.since = point.time;
+        }
+        point.x = timeline_view.from + (Math.floor((point.x - timeline_view.from) / timeline_view.bucket) + 0.5) * timeline_view.bucket;
+        return true;
+    };
+    mergePoints(bubble_chart.data.datasets[0], data.timeline_data_correct.filter(inView), 5);
+    mergePoints(bubble_chart.data.datasets[1], data.timeline_data_incorrect.filter(inView), 3);
     bubble_chart.update();
 })
+
+function requestTimeline(from, to) {
+    timeline_view = {};
+    if (from !== undefined) {
+        timeline_view = {from: from, to: to};
+    }
+    socket.emit('index_connected_timeline', timeline_view);
+}
+
 const bubble_chart_canvas = document.getElementById('TimeLine');
 
 const bubble_chart = new Chart(
@@ -104,6 +177,9 @@ const bubble_chart = new Chart(
                             if (context.parsed.y !== null) {
                                 label += id_to_name[context.parsed.y];
                             }
+                            if (context.raw.count > 1) {
+                                label += ' (' + context.raw.count + ')';
+                            }
                             return label;
                         }
                     }
@@ -113,6 +189,9 @@ const bubble_chart = new Chart(
                         enabled: true,
                         mode: 'xy',
                         modifierKey: 'ctrl',
+                        onPanComplete: function ({chart}) {
+                            requestTimeline(chart.scales.x.min, chart.scales.x.max);
+                        }
                     },
                     zoom: {
                         mode: 'xy',
@@ -121,6 +200,9 @@ const bubble_chart = new Chart(
                             borderColor: 'rgb(54, 162, 235)',
                             borderWidth: 1,
                             backgroundColor: 'rgba(54, 162, 235, 0.3)'
+                        },
+                        onZoomComplete: function ({chart}) {
+                            requestTimeline(chart.scales.x.min, chart.scales.x.max);
                         }
                     }
                 }
@@ -132,6 +214,7 @@ const bubble_chart = new Chart(
 
 bubble_chart_canvas.ondblclick = (evt) => {
     bubble_chart.resetZoom();
+    requestTimeline();
 };
 
 bubble_chart_canvas.onclick = (evt) => {
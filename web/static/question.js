@@ -7,6 +7,43 @@ const table = new DataTable('#table', {
 
 socket = io();
 
+document.querySelector("#upload-form").addEventListener("submit", function (e) {
+    e.preventDefault();
+    let errors = document.getElementById('upload-errors');
+    let status = document.getElementById('upload-status');
+    errors.classList.add('d-none');
+    document.getElementById('upload-sid').value = socket.id;
+    status.innerText = "Uploading...";
+
+    fetch(this.action, {method: "POST", body: new FormData(this)})
+        .then((response) => response.json())
+        .then(function (data) {
+            if (data.errors.length) {
+                errors.innerText = data.errors.map((error) => "Line " + error.line + ": " + error.error).join("\n");
+                errors.classList.remove('d-none');
+                status.innerText = "Nothing imported, " + data.records + " records read";
+            } else {
+                status.innerText = data.imported + " questions imported";
+                document.getElementById('upload-progress').style.width = "100%";
+                table.ajax.reload();
+            }
+        });
+});
+
+// Records are validated first and inserted afterwards, each stage fills a half of the bar
+let uploadRecords = 0;
+
+socket.on("importProgress", function (data) {
+    let bar = document.getElementById('upload-progress');
+    document.getElementById('upload-status').innerText = data.count + " records " + data.stage;
+    if (data.stage === "validated") {
+        uploadRecords = data.count;
+        bar.style.width = "25%";
+    } else {
+        bar.style.width = (50 + 50 * data.count / Math.max(uploadRecords, 1)) + "%";
+    }
+});
+
 
 table.on('click', 'tbody tr', (e) => {
     let classList = e.currentTarget.classList;
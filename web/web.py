@@ -1,26 +1,37 @@
+import collections
+import csv
 import datetime
+import io
 import json
 import os
+import threading
 import time
+from typing import Optional
 
-from flask import Flask, redirect, render_template, jsonify, request
+import numpy as np
+from flask import Flask, redirect, render_template, jsonify, request, abort, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from flask_socketio import SocketIO, emit
-from sqlalchemy import select, func, distinct, or_
+from flask_socketio import SocketIO, emit, join_room
+from sqlalchemy import select, func, distinct, or_, case, delete, literal, Integer, false
+from sqlalchemy.orm import selectinload, joinedload
 
 import tools
 from models import db_session
-from models.questions import QuestionAnswer, Question, AnswerState
-from models.users import Person, PersonGroup
+from models.questions import QuestionAnswer, Question, AnswerState, QuestionGroupAssociation
+from models.search import search_questions
+from models.stats import PersonQuestionStat, AnswerResult, rebuild_stats
+from models.users import Person, PersonGroup, PersonGroupAssociation
 
 from web.forms.users import LoginForm, UserCork, CreateGroupForm, PausePersonForm
 from web.forms.questions import CreateQuestionForm, ImportQuestionForm, PlanQuestionForm, EditQuestionForm, \
-    DeleteQuestionForm
+    DeleteQuestionForm, UploadQuestionsForm
 from web.forms.settings import TelegramSettingsForm, ScheduleSettingsForm, SessionSettingsForm
+from web.question_import import import_questions, ImportFailed
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret_key'
-socketio = SocketIO(app)
+# Native threads: sqlite calls would block every other request under eventlet's single hub thread
+socketio = SocketIO(app, async_mode="threading")
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -81,7 +92,6 @@ def statistic_page(person_id):
                                      where(PersonGroup.id.in_(pg.id for pg in person.groups)))
         subject_stat = []
         bar_stat = [[], [], []]
-        timeline = []
 
         if pause_form.pause.data and pause_form.validate():
             person.is_paused = True
@@ -99,45 +109,51 @@ def statistic_page(person_id):
             db.add(new_answer)
             db.commit()
 
+            tools.EventBus().publish("question_planned", answer_id=new_answer.id, ask_time=new_answer.ask_time)
+
+        all_questions = db.execute(select(Question, PersonQuestionStat).
+                                   join(Question.groups).
+                                   outerjoin(PersonQuestionStat,
+                                             (PersonQuestionStat.question_id == Question.id) &
+                                             (PersonQuestionStat.person_id == person.id)).
+                                   where(PersonGroup.id.in_(pg.id for pg in person.groups)).
+                                   group_by(Question.id).
+                                   order_by(Question.id)).all()
+        questions_by_subject = {}
+        for current_question, stat in all_questions:
+            questions_by_subject.setdefault(current_question.subject, []).append((current_question, stat))
+
         for name in person_subjects:
-            all_questions = db.scalars(select(Question).
-                                       join(Question.groups).
-                                       where(Question.subject == name,
-                                             PersonGroup.id.in_(pg.id for pg in person.groups)).
-                                       group_by(Question.id)).all()
+            subject_questions = questions_by_subject.get(name, [])
 
             correct_count = 0
             correct_count_by_level = {}
             answered_count = 0
             answered_count_by_level = {}
-            questions_count = len(all_questions)
+            questions_count = len(subject_questions)
             person_answers = []
 
-            for current_question in all_questions:
-                answers = db.scalars(select(QuestionAnswer).
-                                     where(QuestionAnswer.person_id == person.id,
-                                           QuestionAnswer.question_id == current_question.id,
-                                           QuestionAnswer.state != AnswerState.NOT_ANSWERED).
-                                     order_by(QuestionAnswer.ask_time)).all()
-
-                question_correct_count = len([1 for a in answers if a.person_answer == current_question.answer])
-                question_incorrect_count = len(answers) - question_correct_count
+            for current_question, stat in subject_questions:
+                question_correct_count = 0
+                question_incorrect_count = 0
 
                 answer_state = "NOT_ANSWERED"
-                if answers:
+                if stat is not None:
+                    question_correct_count = stat.correct_count
+                    question_incorrect_count = stat.incorrect_count + stat.ignored_count
                     answered_count += 1
 
-                    if answers[-1].question.level not in answered_count_by_level.keys():
-                        answered_count_by_level[answers[-1].question.level] = 0
-                        correct_count_by_level[answers[-1].question.level] = 0
+                    if current_question.level not in answered_count_by_level.keys():
+                        answered_count_by_level[current_question.level] = 0
+                        correct_count_by_level[current_question.level] = 0
 
-                    answered_count_by_level[answers[-1].question.level] += 1
+                    answered_count_by_level[current_question.level] += 1
 
-                    if answers[-1].state == AnswerState.TRANSFERRED:
+                    if stat.last_state == AnswerResult.IGNORED:
                         answer_state = "IGNORED"
-                    elif answers[-1].question.answer == answers[-1].person_answer:
+                    elif stat.last_state == AnswerResult.CORRECT:
                         correct_count += 1
-                        correct_count_by_level[answers[-1].question.level] += 1
+                        correct_count_by_level[current_question.level] += 1
                         answer_state = "CORRECT"
                     else:
                         answer_state = "INCORRECT"
@@ -170,32 +186,125 @@ def statistic_page(person_id):
                     progress_by_level[i].append(0)
 
         bar_data = [bar_stat[0], progress_by_level, max_level]
-        for check_time in [datetime.datetime.now() + datetime.timedelta(x / 3) for x in range(-120, 1)]:
-            correct_questions_amount = db.scalar(
-                select(func.count(QuestionAnswer.id)).join(Question).where(QuestionAnswer.person_id == person_id,
-                                                                           QuestionAnswer.answer_time <= check_time,
-                                                                           QuestionAnswer.state == AnswerState.ANSWERED,
-                                                                           Question.answer == QuestionAnswer.person_answer))
-            incorrect_questions_amount = db.scalar(
-                select(func.count(QuestionAnswer.id)).join(Question).where(QuestionAnswer.person_id == person_id,
-                                                                           QuestionAnswer.answer_time <= check_time,
-                                                                           QuestionAnswer.state == AnswerState.ANSWERED,
-                                                                           Question.answer != QuestionAnswer.person_answer))
-            ignored_questions_amount = db.scalar(
-                select(func.count(QuestionAnswer.id)).join(Question).where(QuestionAnswer.person_id == person_id,
-                                                                           QuestionAnswer.ask_time <= check_time,
-                                                                           QuestionAnswer.state == AnswerState.TRANSFERRED,
-                                                                           QuestionAnswer.person_answer == None))
-
-            timeline.append((check_time.timestamp() * 1000, correct_questions_amount, incorrect_questions_amount,
-                             ignored_questions_amount))
-
-        return render_template("statistic.html", person=person,
+        history = db.scalars(select(QuestionAnswer).
+                             options(joinedload(QuestionAnswer.question, innerjoin=True)).
+                             where(QuestionAnswer.person_id == person.id).
+                             order_by(QuestionAnswer.ask_time.desc(), QuestionAnswer.id.desc())).all()
+        timeline = answers_timeline(db, person_id, datetime.datetime.now(),
+                                    request.args.get("timeline_days", 40, type=int),
+                                    request.args.get("timeline_points", 121, type=int))
+
+        return render_template("statistic.html", person=person, history=history,
                                AnswerState=AnswerState, subjects=subject_stat,
                                timeline=timeline, bar_data=json.dumps(bar_data, ensure_ascii=False),
                                pause_form=pause_form, plan_form=plan_form, title="Statistics: " + person.full_name)
 
 
+def answers_timeline(db, person_id, now: datetime.datetime, days=40, points=121) -> list[tuple]:
+    """Cumulative correct, incorrect and ignored counts at evenly spaced checkpoints of the last days.
+    The person's answers are loaded once, the counts are binary searches in the sorted timestamps."""
+    points = min(max(points, 2), 2000)
+    answers = db.execute(select(QuestionAnswer.state, QuestionAnswer.ask_time, QuestionAnswer.answer_time,
+                                QuestionAnswer.person_answer,
+                                (QuestionAnswer.person_answer == Question.answer).label("is_correct")).
+                         join(Question).
+                         where(QuestionAnswer.person_id == person_id,
+                               QuestionAnswer.state != AnswerState.NOT_ANSWERED)).all()
+
+    correct, incorrect, ignored = [], [], []
+    for a in answers:
+        if a.state == AnswerState.ANSWERED and a.answer_time is not None and a.is_correct is not None:
+            (correct if a.is_correct else incorrect).append(a.answer_time.timestamp())
+        elif a.state in (AnswerState.TRANSFERRED, AnswerState.IGNORED) and a.person_answer is None:
+            ignored.append(a.ask_time.timestamp())
+
+    checkpoints = [now + datetime.timedelta(days * (i - points + 1) / (points - 1)) for i in range(points)]
+    checkpoint_stamps = np.array([c.timestamp() for c in checkpoints])
+    counts = [np.searchsorted(np.sort(times), checkpoint_stamps, side="right") for times in (correct, incorrect, ignored)]
+
+    return [(check_time.timestamp() * 1000, int(c), int(i), int(ig))
+            for check_time, c, i, ig in zip(checkpoints, *counts)]
+
+
+TIMELINE_BUCKETS = 200
+
+
+def binned_timeline(db, start: Optional[datetime.datetime], end: Optional[datetime.datetime],
+                    bucket: Optional[float] = None, since: Optional[datetime.datetime] = None) -> dict:
+    """Correct and incorrect answers counted per person per time bucket, so the payload is bounded by
+    persons * TIMELINE_BUCKETS whatever the range is. Buckets are counted from start and are at least
+    (end - start) / TIMELINE_BUCKETS long. With since only the answers given after it are counted,
+    which is valid while the client keeps the same start and bucket. The client's bucket is kept
+    while the range grows up to twice TIMELINE_BUCKETS buckets, so a live view whose end moves with
+    the latest answer doesn't get the whole timeline again on every reconnect."""
+    answered = (QuestionAnswer.person_answer.is_not(None), QuestionAnswer.answer_time.is_not(None))
+    if start is None or end is None:
+        first, last = db.execute(select(func.min(QuestionAnswer.answer_time), func.max(QuestionAnswer.answer_time)).
+                                 where(*answered)).one()
+        start = start or first or datetime.datetime.now()
+        end = end or max(last or start, datetime.datetime.now())
+
+    span = max((end - start).total_seconds() * 1000, 1)
+    min_bucket = max(span / TIMELINE_BUCKETS, 1000)
+    if bucket is None or bucket < (min_bucket / 2 if since is not None else min_bucket):
+        bucket, since = min_bucket, None
+
+    conditions = [*answered, QuestionAnswer.answer_time >= start, QuestionAnswer.answer_time <= end]
+    if since is not None:
+        conditions.append(QuestionAnswer.answer_time > since)
+
+    index = func.cast((func.julianday(QuestionAnswer.answer_time) -
+                       func.julianday(literal(start, QuestionAnswer.answer_time.type))) * 86_400_000 / bucket,
+                      Integer).label("bucket")
+    is_correct = (QuestionAnswer.person_answer == Question.answer).label("is_correct")
+    rows = db.execute(select(QuestionAnswer.person_id, index, is_correct,
+                             func.count(QuestionAnswer.id).label("count"),
+                             func.max(QuestionAnswer.answer_time).label("last")).
+                      join(Question).
+                      where(*conditions).
+                      group_by(QuestionAnswer.person_id, index, is_correct)).all()
+
+    start_stamp = start.timestamp() * 1000
+    data = {"timeline_data_correct": [], "timeline_data_incorrect": []}
+    for row in rows:
+        data["timeline_data_correct" if row.is_correct else "timeline_data_incorrect"].append(
+            {"x": start_stamp + (row.bucket + 0.5) * bucket, "y": row.person_id, "count": row.count})
+
+    last = max((row.last for row in rows), default=since)
+    data.update({"from": start_stamp, "to": end.timestamp() * 1000, "bucket": bucket,
+                 "since": last.isoformat() if last is not None else None,
+                 "incremental": since is not None})
+    return data
+
+
+def people_rows(db, person_ids=None) -> list[dict]:
+    """People with the number of their questions, answered and correctly answered ones, all or only the given."""
+    persons = select(Person.id, Person.full_name, Person.is_paused).order_by(Person.id)
+    counts = select(PersonGroupAssociation.person_id,
+                    func.count(distinct(QuestionGroupAssociation.question_id)).label("questions_count"),
+                    func.count(distinct(PersonQuestionStat.question_id)).label("answered_count"),
+                    func.count(distinct(case((PersonQuestionStat.last_state == AnswerResult.CORRECT,
+                                              PersonQuestionStat.question_id)))).label("correct_count")). \
+        join(QuestionGroupAssociation, QuestionGroupAssociation.group_id == PersonGroupAssociation.group_id). \
+        outerjoin(PersonQuestionStat,
+                  (PersonQuestionStat.person_id == PersonGroupAssociation.person_id) &
+                  (PersonQuestionStat.question_id == QuestionGroupAssociation.question_id)). \
+        group_by(PersonGroupAssociation.person_id)
+    if person_ids is not None:
+        persons = persons.where(Person.id.in_(person_ids))
+        counts = counts.where(PersonGroupAssociation.person_id.in_(person_ids))
+
+    counts = {row.person_id: row for row in db.execute(counts)}
+    people = []
+    for person in db.execute(persons):
+        person_counts = counts.get(person.id)
+        people.append({"person": {"id": person.id, "full_name": person.full_name, "is_paused": person.is_paused},
+                       "correct_count": person_counts.correct_count if person_counts else 0,
+                       "answered_count": person_counts.answered_count if person_counts else 0,
+                       "questions_count": person_counts.questions_count if person_counts else 0})
+    return people
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
@@ -227,7 +336,7 @@ def get_question_stat(data):
 
             for a in answers:
                 a: QuestionAnswer
-                if a.state == AnswerState.TRANSFERRED:
+                if a.state in (AnswerState.TRANSFERRED, AnswerState.IGNORED):
                     answer_state = "IGNORED"
                 elif a.state == AnswerState.NOT_ANSWERED:
                     answer_state = "NOT_ANSWERED"
@@ -242,6 +351,76 @@ def get_question_stat(data):
     emit("question_info", res)
 
 
+EXPORT_COLUMNS = ("answer_id", "person_id", "full_name", "question_id", "question", "subject", "level",
+                  "ask_time", "answer_time", "state", "person_answer", "correct_answer")
+
+
+def export_batches(db, query, size=1000):
+    """Lists of serializable rows, the query is read from the cursor size rows at a time."""
+    for partition in db.execute(query.execution_options(yield_per=size)).partitions():
+        yield [(row.id, row.person_id, row.full_name, row.question_id, row.text, row.subject, row.level,
+                row.ask_time.isoformat(), row.answer_time.isoformat() if row.answer_time else None,
+                row.state.name, row.person_answer, row.answer) for row in partition]
+
+
+@app.route("/export/answers")
+@login_required
+def export_answers():
+    """Streams the answers as csv or jsonl (format argument), optionally filtered by from/to dates of
+    the ask time, a person group and a person. Rows are fetched from the cursor in batches."""
+    args = request.args
+    file_format = args.get("format", "csv")
+    if file_format not in ("csv", "jsonl"):
+        abort(400)
+
+    conditions = []
+    try:
+        if args.get("from"):
+            conditions.append(QuestionAnswer.ask_time >= datetime.datetime.fromisoformat(args["from"]))
+        if args.get("to"):
+            conditions.append(QuestionAnswer.ask_time < datetime.datetime.fromisoformat(args["to"]) +
+                              (datetime.timedelta(days=1) if len(args["to"]) == 10 else datetime.timedelta()))
+        if args.get("group"):
+            conditions.append(QuestionAnswer.person_id.in_(
+                select(PersonGroupAssociation.person_id).where(PersonGroupAssociation.group_id == int(args["group"]))))
+        if args.get("person"):
+            conditions.append(QuestionAnswer.person_id == int(args["person"]))
+    except ValueError:
+        abort(400)
+
+    query = select(QuestionAnswer.id, QuestionAnswer.person_id, Person.full_name, QuestionAnswer.question_id,
+                   Question.text, Question.subject, Question.level, QuestionAnswer.ask_time,
+                   QuestionAnswer.answer_time, QuestionAnswer.state, QuestionAnswer.person_answer,
+                   Question.answer). \
+        join(QuestionAnswer.question). \
+        join(QuestionAnswer.person). \
+        where(*conditions). \
+        order_by(QuestionAnswer.id)
+
+    def generate():
+        with db_session.create_session() as db:
+            if file_format == "jsonl":
+                for batch in export_batches(db, query):
+                    yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False) + "\n"
+                                  for values in batch)
+                return
+
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            for batch in export_batches(db, query):
+                writer.writerows(batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+
+    filename = f"answers.{file_format}"
+    return Response(stream_with_context(generate()),
+                    mimetype="text/csv" if file_format == "csv" else "application/jsonl",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
 @app.route("/questions_ajax")
 def questions_ajax():
     args = request.args
@@ -262,25 +441,33 @@ def questions_ajax():
     if args["order[0][dir]"] != "asc":
         cur_order = cur_order.desc()
 
-    with db_session.create_session() as db:
-        res["recordsTotal"] = db.scalar(func.count(Question.id))
+    search = args.get("search[value]", "").strip()
+    matches = search_questions(search)
 
-        questions = db.scalars(select(Question).
-                               where(or_(Question.text.ilike(f"%{args['search[value]']}%"),
-                                         Question.subject.ilike(f"%{args['search[value]']}%"),
-                                         Question.options.ilike(f"%{args['search[value]']}%"),
-                                         Question.level.ilike(f"%{args['search[value]']}%"),
-                                         Question.article_url.ilike(f"%{args['search[value]']}%"))).
-                               order_by(cur_order)).all()
+    def filtered(query):
+        if not search:
+            return query
+        found = [Question.level == int(search)] if search.isdigit() else []
+        if matches is not None:
+            query = query.outerjoin(matches, matches.c.rowid == Question.id)
+            found.append(matches.c.rowid.is_not(None))
+        return query.where(or_(*found) if found else false())
 
-        res["recordsFiltered"] = len(questions)
+    # The default order of the table is by id, while searching the best matches go first instead
+    if matches is not None and args["order[0][column]"] == "0" and args["order[0][dir]"] == "asc":
+        cur_order = matches.c.rank.nulls_last()
 
-        if offset + length < len(questions):
-            questions = questions[offset:offset + length]
-        else:
-            questions = questions[offset:]
+    with db_session.create_session() as db:
+        res["recordsTotal"] = db.scalar(select(func.count(Question.id)))
+        res["recordsFiltered"] = db.scalar(filtered(select(func.count(Question.id)).select_from(Question))) \
+            if search else res["recordsTotal"]
+
+        query = filtered(select(Question)).options(selectinload(Question.groups)). \
+            order_by(cur_order, Question.id).offset(offset)
+        if length >= 0:
+            query = query.limit(length)
 
-        for q in questions:
+        for q in db.scalars(query):
             q: Question
             options = "<ol>" + "".join(f"<li>{option}</li>" for option in json.loads(q.options)) + "</ol>"
             groups = ", ".join(g.name for g in q.groups)
@@ -289,12 +476,45 @@ def questions_ajax():
     return jsonify(res)
 
 
+@app.route("/questions/upload", methods=["POST"])
+@login_required
+def upload_questions():
+    """Imports a JSON Lines or CSV file, reports the progress to the uploading socket if its sid is given."""
+    with db_session.create_session() as db:
+        form = UploadQuestionsForm()
+        form.groups.choices = [(str(item.id), item.name) for item in db.scalars(select(PersonGroup))]
+
+        if not form.validate():
+            return jsonify({"imported": 0, "records": 0,
+                            "errors": [{"line": 0, "error": error}
+                                       for errors in form.errors.values() for error in errors]}), 400
+
+        def progress(stage, count):
+            if form.sid.data:
+                socketio.emit('importProgress', {"stage": stage, "count": count}, to=form.sid.data)
+            socketio.sleep(0)
+
+        file_format = "csv" if form.file.data.filename.lower().endswith(".csv") else "jsonl"
+        try:
+            imported = import_questions(db, form.file.data.stream, file_format,
+                                        form.subject.data, form.article.data or None,
+                                        [int(item) for item in form.groups.data], progress)
+        except ImportFailed as e:
+            db.rollback()
+            return jsonify({"imported": 0, "records": e.records, "errors": e.errors}), 400
+
+        db.commit()
+
+    return jsonify({"imported": imported, "records": imported, "errors": []})
+
+
 @app.route("/questions", methods=["POST", "GET"])
 @login_required
 def questions_page():
     with db_session.create_session() as db:
         create_question_form = CreateQuestionForm()
         import_question_form = ImportQuestionForm()
+        upload_questions_form = UploadQuestionsForm()
         edit_question_form = EditQuestionForm()
         delete_question_form = DeleteQuestionForm()
 
@@ -303,6 +523,7 @@ def questions_page():
         groups = [(str(item.id), item.name) for item in db.scalars(select(PersonGroup))]
         create_question_form.groups.choices = groups
         import_question_form.groups.choices = groups
+        upload_questions_form.groups.choices = groups
         edit_question_form.groups.choices = groups
 
         if create_question_form.create.data and create_question_form.validate():
@@ -377,14 +598,19 @@ def questions_page():
             question.groups[:] = []
             question.groups.extend(selected_groups)
 
+            rebuild_stats(db, [question_id])
             db.commit()
+            tools.EventBus().publish("question_changed", question_id=question_id)
 
             return redirect("/questions")
 
         if delete_question_form.delete.data:
             question = db.get(Question, int(delete_question_form.id.data))
+            question_id = question.id
+            db.execute(delete(PersonQuestionStat).where(PersonQuestionStat.question_id == question_id))
             db.delete(question)
             db.commit()
+            tools.EventBus().publish("question_changed", question_id=question_id)
 
             return redirect("/questions")
 
@@ -392,6 +618,7 @@ def questions_page():
                                active_tab=active_tab,
                                create_question_form=create_question_form,
                                import_question_form=import_question_form,
+                               upload_questions_form=upload_questions_form,
                                edit_question_form=edit_question_form,
                                delete_question_form=delete_question_form,
                                title="Questions")
@@ -428,6 +655,8 @@ def settings_page():
         settings["week_days"] = [tools.WeekDays(d) for d in schedule_settings_form.week_days.data]
         settings["from_time"] = schedule_settings_form.from_time.data
         settings["to_time"] = schedule_settings_form.to_time.data
+        settings["dispatch_mode"] = schedule_settings_form.dispatch_mode.data
+        settings["dispatch_window"] = schedule_settings_form.dispatch_window.data
 
         settings.update_settings()
         return redirect("/settings")
@@ -448,61 +677,81 @@ def settings_page():
 
 
 @socketio.on('index_connected')
-def people_list():
-    with db_session.create_session() as db:
-        persons = db.scalars(select(Person)).all()
-        for person in persons:
-            all_questions = db.scalars(select(Question).
-                                       join(Question.groups).
-                                       where(PersonGroup.id.in_(pg.id for pg in person.groups)).
-                                       group_by(Question.id)).all()
-            correct_count = 0
-            answered_count = 0
-            questions_count = len(all_questions)
+def people_list(data=None):
+    page_size = min(max(int((data or {}).get("page_size", 100)), 1), 1000)
 
-            for current_question in all_questions:
-                answers = db.scalars(select(QuestionAnswer).
-                                     where(QuestionAnswer.person_id == person.id,
-                                           QuestionAnswer.question_id == current_question.id,
-                                           QuestionAnswer.state != AnswerState.NOT_ANSWERED).
-                                     order_by(QuestionAnswer.ask_time)).all()
+    join_room('dashboard')
+    start_dashboard_task()
 
-                if answers:
-                    answered_count += 1
-                    if answers[-1].question.answer == answers[-1].person_answer:
-                        correct_count += 1
+    with db_session.create_session() as db:
+        persons = people_rows(db)
 
-            emit('peopleList', json.dumps(
-                {"person": {"id": person.id, "full_name": person.full_name},
-                 "correct_count": correct_count,
-                 "answered_count": answered_count,
-                 "questions_count": questions_count},
-                ensure_ascii=False))
-            socketio.sleep(0)
+    pages = max((len(persons) + page_size - 1) // page_size, 1)
+    for page in range(pages):
+        people = persons[page * page_size:(page + 1) * page_size]
+        emit('peopleList', json.dumps({"page": page, "pages": pages, "people": people}, ensure_ascii=False))
+        socketio.sleep(0)
 
 
 @socketio.on('index_connected_timeline')
-def timeline():
+def timeline(data=None):
+    data = data or {}
+
+    def moment(name):
+        return datetime.datetime.fromtimestamp(data[name] / 1000) if data.get(name) is not None else None
+
+    since = datetime.datetime.fromisoformat(data["since"]) if data.get("since") else None
+
     with db_session.create_session() as db:
-        persons = db.scalars(select(Person)).all()
-        timeline_correct = []
-        timeline_incorrect = []
-        id_to_name = {}
-        for person in persons:
-            id_to_name[person.id] = person.full_name
+        config = binned_timeline(db, moment("from"), moment("to"), data.get("bucket"), since)
+
+    emit('timeline', json.dumps(config))
+
+
+DASHBOARD_PUSH_INTERVAL = 1
+_answer_events = collections.deque(maxlen=10_000)
+_dashboard_task = None
+_dashboard_task_lock = threading.Lock()
+
+
+def queue_answer_event(**event):
+    """Subscribed to the "answer" events of the bot. They come from the bot threads,
+    push_answer_events() sends them to the dashboard from the socketio loop."""
+    _answer_events.append(event)
+
+
+tools.EventBus().subscribe("answer", queue_answer_event)
+
+
+def start_dashboard_task():
+    """Starts push_answer_events() with the first dashboard, once even if several connect at the same time."""
+    global _dashboard_task
+
+    with _dashboard_task_lock:
+        if _dashboard_task is None:
+            _dashboard_task = socketio.start_background_task(push_answer_events)
+
+
+def push_answer_events():
+    """Sends the answers of the last interval to every open dashboard. The changed people are counted
+    once for all of them, so the database work doesn't depend on the number of dashboards."""
+    while True:
+        socketio.sleep(DASHBOARD_PUSH_INTERVAL)
+
+        events = []
+        while _answer_events:
+            events.append(_answer_events.popleft())
+        if not events:
+            continue
+
+        with db_session.create_session() as db:
+            people = people_rows(db, {event["person_id"] for event in events})
+
+        update = {"people": people, "timeline_data_correct": [], "timeline_data_incorrect": []}
+        for event in events:
+            if event["result"] in (AnswerResult.CORRECT, AnswerResult.INCORRECT):
+                key = "timeline_data_correct" if event["result"] == AnswerResult.CORRECT else "timeline_data_incorrect"
+                update[key].append({"x": event["time"].timestamp() * 1000, "y": event["person_id"], "count": 1,
+                                    "time": event["time"].isoformat()})
 
-        all_correct_answers = db.scalars(
-            select(QuestionAnswer).join(Question).where(QuestionAnswer.person_answer == Question.answer)).all()
-        all_incorrect_answers = db.scalars(
-            select(QuestionAnswer).join(Question).where(QuestionAnswer.person_answer != Question.answer)).all()
-
-        for answer in all_correct_answers:
-            timeline_correct.append((answer.answer_time.timestamp() * 1000, answer.person_id, 5))
-        for answer in all_incorrect_answers:
-            timeline_incorrect.append((answer.answer_time.timestamp() * 1000, answer.person_id, 3))
-
-        config = {
-            "timeline_data_correct": [{"x": x, "y": y, "r": r} for x, y, r in timeline_correct],
-            "timeline_data_incorrect": [{"x": x, "y": y, "r": r} for x, y, r in timeline_incorrect],
-        }
-        emit('timeline', json.dumps(config))
+        socketio.emit('dashboardUpdate', json.dumps(update, ensure_ascii=False), to='dashboard')